@@ -0,0 +1,162 @@
+"""
+Audio clip helpers for Stash API
+Cuts fingerprint windows with ffmpeg and hands them over as in-memory WAV bytes
+"""
+
+import functools
+import glob
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+from typing import Optional
+
+from api.config import settings
+from api.metrics import process_alive, timed
+
+# Protocols ffmpeg can read directly from the resolved media URL
+PIPEABLE_PROTOCOLS = {"http", "https", "m3u8", "m3u8_native"}
+
+WINDOW_POSITIONS = ("start", "middle", "end")
+
+# Disk-download temp dirs are named stash_<pid>_*, so leftovers can be traced to their process
+WORKDIR_PREFIX = "stash_"
+
+# How often a running ffmpeg clip checks whether its caller gave up on it (seconds)
+CLIP_POLL_INTERVAL = 0.2
+
+
+@functools.cache
+def has_ffmpeg() -> bool:
+    """Probed once per process; the binary doesn't appear or vanish while we run"""
+    return shutil.which("ffmpeg") is not None
+
+
+def make_workdir() -> str:
+    return tempfile.mkdtemp(prefix=f"{WORKDIR_PREFIX}{os.getpid()}_")
+
+
+def sweep_workdirs() -> int:
+    """Remove download dirs left by this process or by processes that are gone (killed mid-download)"""
+    removed = 0
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), f"{WORKDIR_PREFIX}*_*")):
+        try:
+            pid = int(os.path.basename(path)[len(WORKDIR_PREFIX):].split("_", 1)[0])
+        except ValueError:
+            continue
+        if pid != os.getpid() and process_alive(pid):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    return removed
+
+
+def clip_window(window: str, duration: Optional[float]) -> Optional[tuple[float, float]]:
+    """(start, end) seconds of a fingerprint window, or None if the reel has no such window"""
+    start = settings.CLIP_OFFSET
+    if window == "middle":
+        if not duration or duration < start + 2 * settings.CLIP_DURATION:
+            return None
+        start = duration / 2 - settings.CLIP_DURATION / 2
+    elif window == "end":
+        if not duration or duration < start + 3 * settings.CLIP_DURATION:
+            return None
+        start = duration - settings.CLIP_DURATION
+    end = start + settings.CLIP_DURATION
+    if duration:
+        end = min(end, duration)
+    return start, end
+
+
+def plan_windows(duration: Optional[float], count: int) -> dict[str, tuple[float, float]]:
+    """The first `count` of start/middle/end windows that actually fit in the reel"""
+    windows = {}
+    for position in WINDOW_POSITIONS[:max(1, count)]:
+        section = clip_window(position, duration)
+        if section:
+            windows[position] = section
+    return windows
+
+
+class StreamSource:
+    """A resolved media URL; each window is streamed through ffmpeg on demand"""
+
+    def __init__(self, media_url: str, http_headers: dict, duration: Optional[float], info: Optional[dict] = None):
+        self.media_url = media_url
+        self.http_headers = http_headers
+        self.windows = plan_windows(duration, settings.FINGERPRINT_WINDOWS)
+        self.info = info or {}
+
+    def read(self, position: str, stop: Optional[threading.Event] = None) -> Optional[bytes]:
+        return read_clip(self.media_url, self.http_headers, *self.windows[position], stop=stop)
+
+
+class ClipSet:
+    """Windows that were already fetched (disk fallback), keyed by position"""
+
+    def __init__(self, clips: dict[str, bytes], info: Optional[dict] = None):
+        self.clips = clips
+        self.windows = {position: None for position in clips}
+        self.info = info or {}
+
+    def read(self, position: str, stop: Optional[threading.Event] = None) -> Optional[bytes]:
+        return self.clips.get(position)
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int) -> bytes:
+    """Wrap mono s16le PCM in a WAV container so shazamio can decode it from bytes"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def read_clip(media_url: str, http_headers: dict, start: float, end: float,
+              stop: Optional[threading.Event] = None) -> Optional[bytes]:
+    """
+    Stream one window of a remote media URL through ffmpeg into memory.
+
+    `-ss` before `-i` makes ffmpeg seek with range requests, so only the window is
+    fetched; output is mono PCM at CLIP_SAMPLE_RATE read straight off stdout.
+    Setting `stop` kills ffmpeg and returns None, freeing the calling thread.
+    """
+    headers = "".join(f"{key}: {value}\r\n" for key, value in (http_headers or {}).items())
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error"]
+    if headers:
+        cmd += ["-headers", headers]
+    cmd += [
+        "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}",
+        "-i", media_url,
+        "-vn", "-ac", "1", "-ar", str(settings.CLIP_SAMPLE_RATE),
+        "-f", "s16le", "pipe:1",
+    ]
+    deadline = time.monotonic() + settings.CLIP_TIMEOUT
+    with timed("transcode", "ffmpeg_clip"):
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
+            try:
+                while True:
+                    try:
+                        stdout, stderr = proc.communicate(timeout=CLIP_POLL_INTERVAL)
+                        break
+                    except subprocess.TimeoutExpired:
+                        if stop is not None and stop.is_set():
+                            return None
+                        if time.monotonic() >= deadline:
+                            print(f"⚠️ ffmpeg clip timed out after {settings.CLIP_TIMEOUT}s")
+                            return None
+            finally:
+                if proc.returncode is None:
+                    proc.kill()
+                    proc.communicate()
+
+    if proc.returncode != 0 or not stdout:
+        print(f"⚠️ ffmpeg clip failed: {stderr.decode(errors='replace').strip()[:300]}")
+        return None
+    return pcm_to_wav(stdout, settings.CLIP_SAMPLE_RATE)
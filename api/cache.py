@@ -0,0 +1,300 @@
+"""
+Caching primitives for Stash API
+In-memory TTL/LRU tier with an optional SQLite tier that survives restarts
+"""
+
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from api.config import settings
+
+
+_INSTAGRAM_RE = re.compile(r"instagram\.com/(?:[\w.]+/)?(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)", re.I)
+_TIKTOK_RE = re.compile(r"tiktok\.com/(?:@[\w.-]+/(?:video|photo)|v|embed(?:/v2)?)/(\d+)", re.I)
+_TIKTOK_SHORT_RE = re.compile(r"(?:vm|vt)\.tiktok\.com/([A-Za-z0-9]+)", re.I)
+_YOUTUBE_PATH_RE = re.compile(r"(?:youtu\.be/|youtube\.com/(?:shorts|embed|live)/)([A-Za-z0-9_-]{11})", re.I)
+_YOUTUBE_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+# Share/analytics parameters that never change which video a link points to
+TRACKING_PARAMS = {"igsh", "igshid", "si", "fbclid", "gclid", "mibextid", "feature", "ref", "ref_src", "share_id"}
+
+
+def canonical_media_id(url: str) -> str:
+    """
+    Normalise a reel/video URL to a stable cache key.
+
+    Instagram `/p/`, `/reel/`, `/reels/` and `/tv/` links (with or without a username
+    prefix, query string or share suffix) collapse to `instagram:<shortcode>`, TikTok
+    video links to `tiktok:<id>`, YouTube watch/shorts/youtu.be links to `youtube:<id>`.
+    Anything else falls back to host + path + query, minus tracking parameters.
+    """
+    url = (url or "").strip()
+
+    match = _INSTAGRAM_RE.search(url)
+    if match:
+        return f"instagram:{match.group(1)}"
+
+    match = _TIKTOK_RE.search(url)
+    if match:
+        return f"tiktok:{match.group(1)}"
+
+    match = _TIKTOK_SHORT_RE.search(url)
+    if match:
+        return f"tiktok-short:{match.group(1)}"
+
+    match = _YOUTUBE_PATH_RE.search(url)
+    if match:
+        return f"youtube:{match.group(1)}"
+
+    parts = urlsplit(url if "://" in url else f"https://{url}")
+    host = (parts.hostname or "").lower().removeprefix("www.").removeprefix("m.")
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith("utm_")
+    ]
+
+    if host.endswith("youtube.com") and parts.path.rstrip("/") == "/watch":
+        video_id = dict(query).get("v", "")
+        if _YOUTUBE_ID_RE.match(video_id):
+            return f"youtube:{video_id}"
+
+    key = f"url:{host}{parts.path.rstrip('/')}"
+    # The query often *is* the identity (facebook.com/watch/?v=...), so keep it, in a stable order
+    return f"{key}?{urlencode(sorted(query))}" if query else key
+
+
+def normalize_song_key(title: str, artist: str) -> str:
+    """Case/punctuation-insensitive "artist|title" key, ignoring feat. credits and version tags"""
+    def clean(text):
+        text = (text or "").lower()
+        text = re.sub(r"\s*[\(\[](?:feat|ft|with|prod)\.?[^\)\]]*[\)\]]", "", text)
+        text = re.sub(r"\s+-\s+.*(?:remaster|version|edit|mix).*$", "", text)
+        return re.sub(r"[^\w]+", " ", text).strip()
+    return f"{clean(artist)}|{clean(title)}"
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry expiry and a hard size bound"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """
+    Persistent JSON key/value tier; safe to share between worker processes.
+
+    Holds at most `max_rows` entries: every PRUNE_EVERY writes, expired rows are dropped
+    and then the ones closest to expiry until the table is back under the cap.
+    """
+
+    PRUNE_EVERY = 256
+
+    def __init__(self, path: str, table: str, ttl: float, max_rows: int):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn().execute(f"CREATE INDEX IF NOT EXISTS {table}_expires ON {table} (expires_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def get_entry(self, key: str) -> Optional[tuple[Any, float]]:
+        """(value, expires_at) for a live key, so callers can keep the original expiry"""
+        row = self._conn().execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self.delete(key)
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._conn().execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires_at),
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def delete(self, key: str) -> None:
+        self._conn().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def prune(self) -> int:
+        """Drop expired rows, then the soonest-expiring ones past max_rows; returns how many were removed"""
+        conn = self._conn()
+        removed = conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),)).rowcount
+        removed += conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+            "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        ).rowcount
+        return removed
+
+
+class TieredCache:
+    """
+    Memory tier in front of an optional SQLite tier, with hit/miss counters.
+
+    Async code uses aget()/aset(), which keep the (possibly lock-waiting) SQLite
+    calls on a worker thread instead of the event loop.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, path: str = ""):
+        self.name = name
+        self.memory = TTLCache(maxsize, ttl)
+        self.disk = SQLiteCache(path, name, ttl, settings.CACHE_DB_MAX_ROWS) if path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        return self._get_disk(key)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.disk is None:
+            self.misses += 1
+            return None
+        return await asyncio.to_thread(self._get_disk, key)
+
+    def _get_disk(self, key: str) -> Optional[Any]:
+        if self.disk is not None:
+            try:
+                entry = self.disk.get_entry(key)
+            except sqlite3.Error as e:
+                print(f"⚠️ {self.name} disk cache read failed: {e}")
+                entry = None
+            if entry is not None:
+                value, expires_at = entry
+                self.hits += 1
+                self.disk_hits += 1
+                self.memory.set(key, value, expires_at - time.time())
+                return value
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self._set_disk(key, value, ttl)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            await asyncio.to_thread(self._set_disk, key, value, ttl)
+
+    def _set_disk(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        try:
+            self.disk.set(key, value, ttl)
+        except sqlite3.Error as e:
+            print(f"⚠️ {self.name} disk cache write failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "size": len(self.memory),
+            "maxsize": self.memory.maxsize,
+            "persistent": self.disk is not None,
+        }
+
+
+# Recognition results keyed by canonical media ID (stores the search_spotify_strict payload)
+recognition_cache = TieredCache(
+    "recognition",
+    maxsize=settings.RECOGNITION_CACHE_SIZE,
+    ttl=settings.RECOGNITION_CACHE_TTL,
+    path=settings.CACHE_DB_PATH,
+)
+
+# Spotify resolutions keyed by Shazam track key, with "artist|title" as a fallback key
+spotify_search_cache = TieredCache(
+    "spotify_search",
+    maxsize=settings.SPOTIFY_SEARCH_CACHE_SIZE,
+    ttl=settings.SPOTIFY_SEARCH_CACHE_TTL,
+    path=settings.CACHE_DB_PATH,
+)
+
+# Genres keyed by Spotify track ID, with "artist|title" as a fallback key
+genre_cache = TieredCache(
+    "genre",
+    maxsize=settings.GENRE_CACHE_SIZE,
+    ttl=settings.GENRE_CACHE_TTL,
+    path=settings.GENRE_CACHE_DB_PATH,
+)
@@ -0,0 +1,120 @@
+"""
+Shared HTTP clients for upstream APIs (Gemini, Spotify)
+Pooled keep-alive connections, per-upstream timeouts and jittered retries on 429/5xx
+"""
+
+import random
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+from api.config import settings
+from api.metrics import timed, upstream_errors
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """An upstream call failed after all retries"""
+
+    def __init__(self, upstream: str, message: str, status_code: Optional[int] = None):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+        self.status_code = status_code
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Full-jitter exponential backoff, honouring (but capping) a server's Retry-After"""
+    if retry_after:
+        try:
+            return min(float(retry_after), settings.HTTP_MAX_RETRY_AFTER)
+        except ValueError:
+            pass  # HTTP-date form; fall through to our own backoff
+    return random.uniform(0, min(settings.HTTP_BACKOFF_MAX, settings.HTTP_BACKOFF_BASE * 2 ** attempt))
+
+
+# --- Gemini (httpx) ---
+
+_gemini_client: Optional[httpx.Client] = None
+_gemini_lock = threading.Lock()
+
+
+def get_gemini_client() -> httpx.Client:
+    global _gemini_client
+    if _gemini_client is None:
+        with _gemini_lock:
+            if _gemini_client is None:
+                _gemini_client = httpx.Client(
+                    base_url=settings.GEMINI_API_BASE,
+                    timeout=httpx.Timeout(settings.GEMINI_READ_TIMEOUT, connect=settings.GEMINI_CONNECT_TIMEOUT),
+                    limits=httpx.Limits(max_connections=settings.HTTP_POOL_SIZE, max_keepalive_connections=settings.HTTP_POOL_SIZE),
+                )
+    return _gemini_client
+
+
+def gemini_generate(prompt: str, generation_config: Optional[dict] = None) -> str:
+    """Send one prompt to Gemini and return the first candidate's text"""
+    try:
+        with timed("gemini", "generate"):
+            return _gemini_generate(prompt, generation_config)
+    except UpstreamError:
+        upstream_errors.inc(upstream="gemini")
+        raise
+
+
+def _gemini_generate(prompt: str, generation_config: Optional[dict]) -> str:
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    if generation_config:
+        payload["generationConfig"] = generation_config
+
+    path = f"/v1beta/models/{settings.GEMINI_MODEL}:generateContent"
+    client = get_gemini_client()
+    for attempt in range(settings.HTTP_RETRIES + 1):
+        try:
+            response = client.post(path, params={"key": settings.GEMINI_API_KEY}, json=payload)
+        except httpx.TransportError as e:
+            if attempt == settings.HTTP_RETRIES:
+                raise UpstreamError("gemini", str(e)) from e
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        if response.status_code in RETRY_STATUSES and attempt < settings.HTTP_RETRIES:
+            time.sleep(backoff_delay(attempt, response.headers.get("retry-after")))
+            continue
+        if response.is_error:
+            raise UpstreamError("gemini", f"HTTP {response.status_code}", response.status_code)
+
+        data = response.json()
+        return data["candidates"][0]["content"]["parts"][0]["text"]
+
+    raise UpstreamError("gemini", "retries exhausted")
+
+
+# --- Spotify (built on first use; see api.spotify_client) ---
+
+_app_spotify = None
+_app_spotify_lock = threading.Lock()
+
+
+def app_spotify():
+    """Shared client-credentials Spotify client for catalog search"""
+    global _app_spotify
+    if _app_spotify is None:
+        with _app_spotify_lock:
+            if _app_spotify is None:
+                from api.spotify_client import app_spotify as build
+                _app_spotify = build()
+    return _app_spotify
+
+
+def user_spotify(token: str):
+    """Per-request Spotify client for a user's OAuth token, on the shared transport"""
+    from api.spotify_client import user_spotify as build
+    return build(token)
+
+
+def warm_spotify() -> None:
+    """Fetch the client-credentials token now instead of on the first reel"""
+    app_spotify().auth_manager.get_access_token(as_dict=False)
@@ -22,12 +22,113 @@ class Settings:
     
     # Rate Limiting
     RATE_LIMIT_PER_DAY: int = int(os.getenv("RATE_LIMIT_PER_DAY", "10"))
-    
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()  # memory | sqlite | redis
+    RATE_LIMIT_DB_PATH: str = os.getenv("RATE_LIMIT_DB_PATH", "/tmp/stash_ratelimit.db")
+    RATE_LIMIT_EVICT_INTERVAL: int = int(os.getenv("RATE_LIMIT_EVICT_INTERVAL", "300"))
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+    # Pipeline Concurrency (per worker process)
+    DOWNLOAD_CONCURRENCY: int = int(os.getenv("DOWNLOAD_CONCURRENCY", "4"))
+    DOWNLOAD_QUEUE_SIZE: int = int(os.getenv("DOWNLOAD_QUEUE_SIZE", "16"))
+    FINGERPRINT_CONCURRENCY: int = int(os.getenv("FINGERPRINT_CONCURRENCY", "4"))
+    FINGERPRINT_QUEUE_SIZE: int = int(os.getenv("FINGERPRINT_QUEUE_SIZE", "16"))
+    SPOTIFY_CONCURRENCY: int = int(os.getenv("SPOTIFY_CONCURRENCY", "8"))
+    SPOTIFY_QUEUE_SIZE: int = int(os.getenv("SPOTIFY_QUEUE_SIZE", "32"))
+    OVERLOAD_RETRY_AFTER: int = int(os.getenv("OVERLOAD_RETRY_AFTER", "5"))
+    MAX_INFLIGHT_RECOGNITIONS: int = int(os.getenv("MAX_INFLIGHT_RECOGNITIONS", "256"))
+    BATCH_MAX_URLS: int = int(os.getenv("BATCH_MAX_URLS", "50"))
+
+    # Async Jobs (/recognize?async=true): SQLite queue drained by separate worker processes
+    JOB_DB_PATH: str = os.getenv("JOB_DB_PATH", "/tmp/stash_jobs.db")
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))  # 0 = run `python -m api.job_worker` yourself
+    JOB_WORKER_CONCURRENCY: int = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+    JOB_FINGERPRINT_PROCESSES: int = int(os.getenv("JOB_FINGERPRINT_PROCESSES", "1"))
+    JOB_LEASE_SECONDS: float = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_POLL_INTERVAL: float = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+    JOB_RETENTION: int = int(os.getenv("JOB_RETENTION", "86400"))
+
+    # Fingerprinting (signature generation runs in this many worker processes; 0 = in-process)
+    FINGERPRINT_PROCESSES: int = int(os.getenv("FINGERPRINT_PROCESSES", str(os.cpu_count() or 1)))
+    FINGERPRINT_SEGMENT_SECONDS: int = int(os.getenv("FINGERPRINT_SEGMENT_SECONDS", "10"))
+    FINGERPRINT_WINDOWS: int = int(os.getenv("FINGERPRINT_WINDOWS", "3"))  # start, middle, end
+    FINGERPRINT_BUDGET: float = float(os.getenv("FINGERPRINT_BUDGET", "25"))
+
+    # Fair Scheduling (recognitions share pipeline slots per client; X-Stash-Key holders get the pro lane)
+    PRO_API_KEYS: List[str] = [key.strip() for key in os.getenv("PRO_API_KEYS", "").split(",") if key.strip()]
+    # Every admitted recognition puts up to FINGERPRINT_WINDOWS calls on the download and fingerprint
+    # stages at once, so by default admit only as many as both stages can hold without a 503
+    SCHEDULER_SLOTS: int = int(os.getenv("SCHEDULER_SLOTS", str(max(1, min(
+        DOWNLOAD_CONCURRENCY + DOWNLOAD_QUEUE_SIZE, FINGERPRINT_CONCURRENCY + FINGERPRINT_QUEUE_SIZE,
+    ) // max(1, FINGERPRINT_WINDOWS)))))
+    SCHEDULER_QUEUE_SIZE: int = int(os.getenv("SCHEDULER_QUEUE_SIZE", "256"))
+    SCHEDULER_CLIENT_QUEUE: int = int(os.getenv("SCHEDULER_CLIENT_QUEUE", str(BATCH_MAX_URLS)))
+    SCHEDULER_CLIENT_INFLIGHT: int = int(os.getenv("SCHEDULER_CLIENT_INFLIGHT", "2"))
+    SCHEDULER_PRO_INFLIGHT: int = int(os.getenv("SCHEDULER_PRO_INFLIGHT", "6"))
+    SCHEDULER_PRO_WEIGHT: float = float(os.getenv("SCHEDULER_PRO_WEIGHT", "4"))
+
+    # Metadata Fast Path (use the song a reel declares before fingerprinting)
+    METADATA_FIRST: bool = os.getenv("METADATA_FIRST", "true").lower() == "true"
+
+    # Local Fingerprint Index (answers repeat songs without calling Shazam)
+    LOCAL_INDEX_ENABLED: bool = os.getenv("LOCAL_INDEX_ENABLED", "true").lower() == "true"
+    LOCAL_INDEX_PATH: str = os.getenv("LOCAL_INDEX_PATH", "/tmp/stash_fpindex")
+    LOCAL_INDEX_MIN_VOTES: int = int(os.getenv("LOCAL_INDEX_MIN_VOTES", "15"))
+    LOCAL_INDEX_COMPACT_EVERY: int = int(os.getenv("LOCAL_INDEX_COMPACT_EVERY", "64"))
+
+    # Fingerprint Clip (download only a short window instead of the whole reel)
+    CLIP_ENABLED: bool = os.getenv("CLIP_ENABLED", "true").lower() == "true"
+    CLIP_OFFSET: float = float(os.getenv("CLIP_OFFSET", "0"))
+    CLIP_DURATION: float = float(os.getenv("CLIP_DURATION", "12"))
+    CLIP_SAMPLE_RATE: int = int(os.getenv("CLIP_SAMPLE_RATE", "16000"))
+    CLIP_TIMEOUT: int = int(os.getenv("CLIP_TIMEOUT", "30"))
+
+    # yt-dlp Instance Pool (idle instances kept per mode/account, recycled after N uses)
+    YTDL_POOL_SIZE: int = int(os.getenv("YTDL_POOL_SIZE", str(DOWNLOAD_CONCURRENCY)))
+    YTDL_MAX_USES: int = int(os.getenv("YTDL_MAX_USES", "50"))
+
+    # Caching (CACHE_DB_PATH enables the persistent SQLite tier, e.g. /tmp/stash_cache.db)
+    CACHE_DB_PATH: str = os.getenv("CACHE_DB_PATH", "")
+    CACHE_DB_MAX_ROWS: int = int(os.getenv("CACHE_DB_MAX_ROWS", "100000"))  # per SQLite cache table
+    RECOGNITION_CACHE_SIZE: int = int(os.getenv("RECOGNITION_CACHE_SIZE", "5000"))
+    RECOGNITION_CACHE_TTL: int = int(os.getenv("RECOGNITION_CACHE_TTL", str(7 * 86400)))
+    SPOTIFY_SEARCH_CACHE_SIZE: int = int(os.getenv("SPOTIFY_SEARCH_CACHE_SIZE", "20000"))
+    SPOTIFY_SEARCH_CACHE_TTL: int = int(os.getenv("SPOTIFY_SEARCH_CACHE_TTL", str(7 * 86400)))
+    SPOTIFY_CONTEXT_CACHE_SIZE: int = int(os.getenv("SPOTIFY_CONTEXT_CACHE_SIZE", "5000"))
+    SPOTIFY_CONTEXT_TTL: int = int(os.getenv("SPOTIFY_CONTEXT_TTL", "600"))
+    GENRE_CACHE_DB_PATH: str = os.getenv("GENRE_CACHE_DB_PATH", "/tmp/stash_genres.db")
+    GENRE_CACHE_SIZE: int = int(os.getenv("GENRE_CACHE_SIZE", "20000"))
+    GENRE_CACHE_TTL: int = int(os.getenv("GENRE_CACHE_TTL", str(30 * 86400)))
+    GENRE_NEGATIVE_TTL: int = int(os.getenv("GENRE_NEGATIVE_TTL", "600"))
+    SAVE_GENRE_WAIT: float = float(os.getenv("SAVE_GENRE_WAIT", "1.5"))  # /save_track waits this long for an uncached genre
+
+    # Genre Micro-batching (one Gemini prompt per window of concurrent saves)
+    GENRE_BATCH_WINDOW_MS: int = int(os.getenv("GENRE_BATCH_WINDOW_MS", "50"))
+    GENRE_BATCH_SIZE: int = int(os.getenv("GENRE_BATCH_SIZE", "20"))
+    GENRE_BATCH_CONCURRENCY: int = int(os.getenv("GENRE_BATCH_CONCURRENCY", "4"))
+    GENRE_BATCH_TIMEOUT: float = float(os.getenv("GENRE_BATCH_TIMEOUT", "30"))
+
     # API Keys
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
     SPOTIFY_CLIENT_ID: str = os.getenv("SPOTIFY_CLIENT_ID", "")
     SPOTIFY_CLIENT_SECRET: str = os.getenv("SPOTIFY_CLIENT_SECRET", "")
     
+    # Upstream HTTP Clients (timeouts in seconds)
+    GEMINI_API_BASE: str = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+    GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+    SPOTIFY_API_BASE: str = os.getenv("SPOTIFY_API_BASE", "https://api.spotify.com/v1/")
+    SPOTIFY_TOKEN_URL: str = os.getenv("SPOTIFY_TOKEN_URL", "https://accounts.spotify.com/api/token")
+    SHAZAM_API_BASE: str = os.getenv("SHAZAM_API_BASE", "https://amp.shazam.com")
+    GEMINI_CONNECT_TIMEOUT: float = float(os.getenv("GEMINI_CONNECT_TIMEOUT", "3"))
+    GEMINI_READ_TIMEOUT: float = float(os.getenv("GEMINI_READ_TIMEOUT", "15"))
+    SPOTIFY_CONNECT_TIMEOUT: float = float(os.getenv("SPOTIFY_CONNECT_TIMEOUT", "3"))
+    SPOTIFY_READ_TIMEOUT: float = float(os.getenv("SPOTIFY_READ_TIMEOUT", "10"))
+    HTTP_POOL_SIZE: int = int(os.getenv("HTTP_POOL_SIZE", "20"))
+    HTTP_RETRIES: int = int(os.getenv("HTTP_RETRIES", "2"))
+    HTTP_BACKOFF_BASE: float = float(os.getenv("HTTP_BACKOFF_BASE", "0.3"))
+    HTTP_BACKOFF_MAX: float = float(os.getenv("HTTP_BACKOFF_MAX", "4"))
+    HTTP_MAX_RETRY_AFTER: float = float(os.getenv("HTTP_MAX_RETRY_AFTER", "10"))
+    
     # Feature Flags
     ENABLE_GENRE_DETECTION: bool = os.getenv("ENABLE_GENRE_DETECTION", "true").lower() == "true"
     ENABLE_DEBUG_LOGS: bool = os.getenv("ENABLE_DEBUG_LOGS", "false").lower() == "true"
@@ -35,8 +136,31 @@ class Settings:
     # Environment
     ENVIRONMENT: str = os.getenv("ENVIRONMENT", "production")
     
+    # Startup (warm-up runs before /ready reports 200)
+    WARMUP_ENABLED: bool = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_TIMEOUT: float = float(os.getenv("WARMUP_TIMEOUT", "60"))
+
+    # Observability (Server-Timing response header with per-stage durations)
+    SERVER_TIMING: bool = os.getenv("SERVER_TIMING", "false").lower() == "true"
+    METRICS_DIR: str = os.getenv("METRICS_DIR", "")  # shared by all worker processes, e.g. /tmp/stash_metrics
+    METRICS_FLUSH_INTERVAL: float = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+    # Production Server (main.py; WEB_WORKERS > 1 runs a multi-process supervisor)
+    WEB_WORKERS: int = int(os.getenv("WEB_WORKERS", "1"))
+    WORKER_MAX_REQUESTS: int = int(os.getenv("WORKER_MAX_REQUESTS", "1000"))  # recycle a worker after N requests
+    WORKER_MAX_REQUESTS_JITTER: int = int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "100"))
+    GRACEFUL_TIMEOUT: int = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
     # Instagram Cookies (Multiple Accounts for Rotation)
     YTDLP_COOKIES: List[str] = []
+    COOKIE_DIR: str = os.getenv("COOKIE_DIR", "/tmp/stash_cookies")
+    COOKIE_COOLDOWN: float = float(os.getenv("COOKIE_COOLDOWN", "300"))
+    COOKIE_MAX_COOLDOWN: float = float(os.getenv("COOKIE_MAX_COOLDOWN", "3600"))
+    COOKIE_ACQUIRE_TIMEOUT: float = float(os.getenv("COOKIE_ACQUIRE_TIMEOUT", "10"))
+    COOKIE_DB_PATH: str = os.getenv("COOKIE_DB_PATH", RATE_LIMIT_DB_PATH)  # account state shared across processes
+    COOKIE_LEASE: float = float(os.getenv("COOKIE_LEASE", "300"))  # frees accounts held by a process that died
+    COOKIELESS_SKIP_AFTER: int = int(os.getenv("COOKIELESS_SKIP_AFTER", "2"))
+    COOKIELESS_MEMORY_TTL: int = int(os.getenv("COOKIELESS_MEMORY_TTL", "1800"))
     
     def __init__(self):
         """Load all YTDLP_COOKIES* environment variables"""
@@ -62,7 +186,7 @@ class Settings:
 
     
     def validate(self) -> None:
-        """Validate that all required environment variables are set"""
+        """Validate that all required environment variables are set (called at app startup, not on import)"""
         required_vars = {
             "GEMINI_API_KEY": self.GEMINI_API_KEY,
             "SPOTIFY_CLIENT_ID": self.SPOTIFY_CLIENT_ID,
@@ -80,15 +204,8 @@ class Settings:
         print("✅ All required environment variables are set")
         print(f"🌍 Environment: {self.ENVIRONMENT}")
         print(f"🔒 CORS Origins: {', '.join(self.ALLOWED_ORIGINS)}")
-        print(f"⏱️  Rate Limit: {self.RATE_LIMIT_PER_DAY} requests/day")
+        print(f"⏱️  Rate Limit: {self.RATE_LIMIT_PER_DAY} requests/day ({self.RATE_LIMIT_BACKEND} backend)")
 
 
 # Global settings instance
 settings = Settings()
-
-# Validate on import
-try:
-    settings.validate()
-except ValueError as e:
-    print(str(e))
-    raise
@@ -0,0 +1,289 @@
+"""
+Cookie account pool for Stash API
+One cookie file per YTDLP_COOKIES account, health-aware selection, and cooldowns for burned accounts
+(account state is shared by every process on the host through a SQLite file)
+"""
+
+import atexit
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+from api.config import settings
+
+# yt-dlp error text that means the account (or the anonymous client) was refused, not that the post is gone
+BLOCKED_MARKERS = (
+    "login required",
+    "log in",
+    "login_required",
+    "checkpoint",
+    "rate-limit",
+    "rate limit",
+    "429",
+    "too many requests",
+    "please wait a few minutes",
+    "use --cookies",
+)
+
+
+def classify_failure(error: Optional[BaseException]) -> str:
+    """Why a download failed: blocked (login wall, 429) or error (anything else, e.g. a deleted post)"""
+    message = str(error or "").lower()
+    return "blocked" if any(marker in message for marker in BLOCKED_MARKERS) else "error"
+
+
+def media_domain(url: str) -> str:
+    host = urlsplit(url if "://" in url else f"https://{url}").hostname or ""
+    return host.lower().removeprefix("www.").removeprefix("m.")
+
+
+class CookieAccount:
+    """A cookie file on disk; its health record lives in the pool's shared database"""
+
+    def __init__(self, number: int, path: str, key: str):
+        self.number = number  # 1-based, as in the logs
+        self.path = path
+        self.key = key  # hash of the cookie content, the same in every process
+
+
+def _health(successes: int, failures: int) -> float:
+    # Laplace-smoothed success rate so new accounts start at 0.5, not 0 or 1
+    return (successes + 1) / (successes + failures + 2)
+
+
+class _SharedState:
+    """One SQLite connection per thread on a file shared by every process on the host"""
+
+    def __init__(self, path: str, schema: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(schema)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, fn):
+        conn = self._conn()
+        # IMMEDIATE takes the write lock up front so check-then-write is atomic across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+
+class CookiePool(_SharedState):
+    """
+    Hands out one account per download at a time (an account is never shared by
+    concurrent requests), preferring healthy, least-recently-used accounts.
+
+    An account that hits a login wall or 429 is cooled down for COOKIE_COOLDOWN
+    seconds, doubling on each consecutive block up to COOKIE_MAX_COOLDOWN; the
+    first success closes the breaker again.
+
+    Health, cooldowns and who holds an account are kept in COOKIE_DB_PATH, so web
+    workers and job workers on the host see each other's blocks and never use one
+    account at the same time. A hold expires after COOKIE_LEASE seconds, so an account
+    taken by a process that died comes back on its own.
+    """
+
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, cookies: list[str], directory: str, cooldown: float, max_cooldown: float,
+                 path: str, lease: float):
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.lease = lease
+        self.accounts: list[CookieAccount] = []
+        self._directory = None
+        super().__init__(
+            path,
+            "CREATE TABLE IF NOT EXISTS cookie_accounts ("
+            "key TEXT PRIMARY KEY, held_until REAL NOT NULL DEFAULT 0, last_used REAL NOT NULL DEFAULT 0, "
+            "successes INTEGER NOT NULL DEFAULT 0, failures INTEGER NOT NULL DEFAULT 0, "
+            "consecutive_blocks INTEGER NOT NULL DEFAULT 0, cooldown_until REAL NOT NULL DEFAULT 0)",
+        )
+        if cookies:
+            self._materialise(cookies, directory)
+            self._conn().executemany(
+                "INSERT OR IGNORE INTO cookie_accounts (key) VALUES (?)", [(a.key,) for a in self.accounts]
+            )
+
+    def _materialise(self, cookies: list[str], directory: str) -> None:
+        # Per-process directory: yt-dlp writes refreshed cookies back into the file it was given
+        os.makedirs(directory, exist_ok=True)
+        self._directory = tempfile.mkdtemp(prefix=f"{os.getpid()}_", dir=directory)
+        atexit.register(shutil.rmtree, self._directory, True)
+        for number, content in enumerate(cookies, start=1):
+            path = os.path.join(self._directory, f"account_{number}.txt")
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+            key = hashlib.sha256(content.encode()).hexdigest()[:16]
+            self.accounts.append(CookieAccount(number, path, key))
+
+    def _rows(self, conn: sqlite3.Connection) -> dict[str, sqlite3.Row]:
+        keys = [account.key for account in self.accounts]
+        rows = conn.execute(
+            f"SELECT * FROM cookie_accounts WHERE key IN ({','.join('?' * len(keys))})", keys
+        ).fetchall()
+        return {row["key"]: row for row in rows}
+
+    def _take(self, conn: sqlite3.Connection) -> tuple[Optional[CookieAccount], bool]:
+        """(best idle account, now held by us; whether any account is held by someone)"""
+        now = time.time()
+        rows = self._rows(conn)
+        candidates = [
+            account for account in self.accounts
+            if rows[account.key]["held_until"] <= now and rows[account.key]["cooldown_until"] <= now
+        ]
+        busy = any(row["held_until"] > now for row in rows.values())
+        if not candidates:
+            return None, busy
+        account = min(candidates, key=lambda a: (
+            -round(_health(rows[a.key]["successes"], rows[a.key]["failures"]), 1), rows[a.key]["last_used"]
+        ))
+        conn.execute(
+            "UPDATE cookie_accounts SET held_until = ?, last_used = ? WHERE key = ?",
+            (now + self.lease, now, account.key),
+        )
+        return account, busy
+
+    def acquire(self, timeout: float) -> Optional[CookieAccount]:
+        """Best available account, waiting up to `timeout` for one to free up"""
+        if not self.accounts:
+            return None
+        deadline = time.monotonic() + timeout
+        while True:
+            account, busy = self._transaction(self._take)
+            if account is not None:
+                return account
+            # Nothing idle: wait for a release, or give up if every account is cooling down
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not busy:
+                return None
+            time.sleep(min(self.POLL_INTERVAL, remaining))
+
+    def release(self, account: CookieAccount, outcome: str) -> None:
+        def update(conn):
+            if outcome == "ok":
+                conn.execute(
+                    "UPDATE cookie_accounts SET held_until = 0, successes = successes + 1, "
+                    "consecutive_blocks = 0 WHERE key = ?",
+                    (account.key,),
+                )
+            elif outcome == "blocked":
+                blocks = self._rows(conn)[account.key]["consecutive_blocks"] + 1
+                cooldown = min(self.cooldown * 2 ** (blocks - 1), self.max_cooldown)
+                conn.execute(
+                    "UPDATE cookie_accounts SET held_until = 0, failures = failures + 1, "
+                    "consecutive_blocks = ?, cooldown_until = ? WHERE key = ?",
+                    (blocks, time.time() + cooldown, account.key),
+                )
+                return cooldown
+            else:
+                # Not the account's fault (deleted post, network): no cooldown
+                conn.execute(
+                    "UPDATE cookie_accounts SET held_until = 0, failures = failures + 1 WHERE key = ?",
+                    (account.key,),
+                )
+            return None
+
+        cooldown = self._transaction(update)
+        if cooldown is not None:
+            print(f"🍪 Cookie account #{account.number} blocked; cooling down for {int(cooldown)}s")
+
+    def stats(self) -> dict:
+        now = time.time()
+        rows = self._rows(self._conn()) if self.accounts else {}
+        accounts = []
+        for account in self.accounts:
+            row = rows[account.key]
+            accounts.append({
+                "account": account.number,
+                "health": round(_health(row["successes"], row["failures"]), 3),
+                "successes": row["successes"],
+                "failures": row["failures"],
+                "in_use": row["held_until"] > now,
+                "cooldown_remaining": max(0, int(row["cooldown_until"] - now)),
+            })
+        available = sum(not a["in_use"] and not a["cooldown_remaining"] for a in accounts)
+        return {"accounts": accounts, "available": available}
+
+
+class CookielessMemory(_SharedState):
+    """
+    Per-domain memory of whether anonymous downloads work. After COOKIELESS_SKIP_AFTER
+    blocked attempts in a row the domain goes straight to cookies until the entry expires.
+    Shared through COOKIE_DB_PATH like the account pool.
+    """
+
+    def __init__(self, skip_after: int, ttl: float, path: str):
+        self.skip_after = skip_after
+        self.ttl = ttl
+        self.skipped = 0
+        super().__init__(
+            path,
+            "CREATE TABLE IF NOT EXISTS cookieless_blocks "
+            "(domain TEXT PRIMARY KEY, blocks INTEGER NOT NULL, expires_at REAL NOT NULL)",
+        )
+
+    def _blocks(self, conn: sqlite3.Connection, domain: str) -> int:
+        row = conn.execute(
+            "SELECT blocks FROM cookieless_blocks WHERE domain = ? AND expires_at > ?", (domain, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def should_try(self, domain: str) -> bool:
+        if self._blocks(self._conn(), domain) < self.skip_after:
+            return True
+        self.skipped += 1
+        return False
+
+    def record(self, domain: str, outcome: str) -> None:
+        if outcome == "ok":
+            self._conn().execute("DELETE FROM cookieless_blocks WHERE domain = ?", (domain,))
+        elif outcome == "blocked":
+            self._transaction(lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO cookieless_blocks (domain, blocks, expires_at) VALUES (?, ?, ?)",
+                (domain, self._blocks(conn, domain) + 1, time.time() + self.ttl),
+            ))
+
+    def stats(self) -> dict:
+        restricted = self._conn().execute(
+            "SELECT COUNT(*) FROM cookieless_blocks WHERE expires_at > ?", (time.time(),)
+        ).fetchone()[0]
+        return {"restricted_domains": restricted, "skipped_attempts": self.skipped}
+
+
+cookie_pool = CookiePool(
+    settings.YTDLP_COOKIES,
+    directory=settings.COOKIE_DIR,
+    cooldown=settings.COOKIE_COOLDOWN,
+    max_cooldown=settings.COOKIE_MAX_COOLDOWN,
+    path=settings.COOKIE_DB_PATH,
+    lease=settings.COOKIE_LEASE,
+)
+cookieless_memory = CookielessMemory(
+    skip_after=settings.COOKIELESS_SKIP_AFTER,
+    ttl=settings.COOKIELESS_MEMORY_TTL,
+    path=settings.COOKIE_DB_PATH,
+)
@@ -0,0 +1,116 @@
+"""
+Bounded execution layer for the recognition pipeline
+Keeps blocking work (yt-dlp, ffmpeg, spotipy) off the event loop and sheds load early
+"""
+
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from api.config import settings
+from api.metrics import observe, stage_errors
+
+
+class StageOverloaded(Exception):
+    """Raised when a stage's queue is full; surfaced to clients as 503 + Retry-After"""
+
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f"{stage} stage is at capacity")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class Stage:
+    """
+    A pipeline stage with a fixed number of concurrent slots and a bounded wait queue.
+
+    Blocking callables run on the stage's own thread pool, coroutines are gated by a
+    semaphore. Once `concurrency + queue_size` calls are admitted, new calls fail fast
+    with StageOverloaded instead of piling up behind a slow reel.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.capacity = self.concurrency + max(0, queue_size)
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.concurrency,
+            thread_name_prefix=f"stash-{name}",
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    def _admit(self) -> None:
+        if self.pending >= self.capacity:
+            raise StageOverloaded(self.name, settings.OVERLOAD_RETRY_AFTER)
+        self.pending += 1
+
+    def _release(self, *_) -> None:
+        self.pending -= 1
+
+    def _timed_call(self, op: str, call):
+        # Runs on the worker thread, so the histogram excludes time spent queued
+        started = time.perf_counter()
+        try:
+            return call()
+        except Exception:
+            stage_errors.inc(stage=self.name, op=op)
+            raise
+        finally:
+            observe(self.name, op, time.perf_counter() - started)
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking callable on this stage's worker threads"""
+        self._admit()
+        loop = asyncio.get_running_loop()
+        op = getattr(fn, "__name__", "call")
+        # Carry the request context into the thread (per-request Server-Timing entries)
+        context = contextvars.copy_context()
+        try:
+            future = self._executor.submit(context.run, self._timed_call, op, partial(fn, *args, **kwargs))
+        except BaseException:
+            self._release()
+            raise
+        # Release the slot when the thread finishes, not when the caller stops waiting,
+        # so a disconnected client can't free capacity that is still in use.
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        return await asyncio.wrap_future(future)
+
+    async def run_async(self, fn, *args, **kwargs):
+        """Run a coroutine function under this stage's concurrency cap"""
+        self._admit()
+        try:
+            async with self._semaphore:
+                op = getattr(fn, "__name__", "call")
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    stage_errors.inc(stage=self.name, op=op)
+                    raise
+                finally:
+                    observe(self.name, op, time.perf_counter() - started)
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "concurrency": self.concurrency, "capacity": self.capacity}
+
+    async def drain(self, timeout: float) -> None:
+        """Let admitted calls finish (up to `timeout`), then stop the worker threads"""
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self.pending:
+            print(f"⚠️ {self.name} stage still had {self.pending} call(s) running at shutdown")
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+download_stage = Stage("download", settings.DOWNLOAD_CONCURRENCY, settings.DOWNLOAD_QUEUE_SIZE)
+fingerprint_stage = Stage("fingerprint", settings.FINGERPRINT_CONCURRENCY, settings.FINGERPRINT_QUEUE_SIZE)
+spotify_stage = Stage("spotify", settings.SPOTIFY_CONCURRENCY, settings.SPOTIFY_QUEUE_SIZE)
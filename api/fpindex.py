@@ -0,0 +1,261 @@
+"""
+Local fingerprint index for Stash API
+Landmark hashes from Shazam signatures → identified tracks, so repeat songs skip the network
+
+On-disk layout (LOCAL_INDEX_PATH directory, uint32 in native byte order):
+  segment.bin   header (magic, count) + three sorted parallel arrays: hash, track, time
+  delta.bin     append-only (hash, track, time) triples added since the last compaction
+  tracks.jsonl  one resolved Spotify payload per line; the line number is the track id
+
+The segment is memory-mapped, so every worker process shares the same page cache and
+start-up cost is a single mmap. New tracks go to the delta log and are merged into a
+fresh segment every LOCAL_INDEX_COMPACT_EVERY tracks.
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from base64 import b64decode
+from bisect import bisect_left
+from collections import Counter
+from typing import Optional
+
+from api.config import settings
+
+SEGMENT_MAGIC = 0x58465453  # "STFX"
+HEADER = struct.Struct("II")
+TRIPLE = array("I").itemsize * 3
+
+FAN_OUT = 5  # Pairs per anchor peak
+MAX_DELTA = 255  # FFT passes (~2s at 128 samples/pass, 16 kHz)
+OFFSET_BIN = 2  # Tolerate a few passes of jitter between clip start positions
+
+
+def landmarks(signature_uri: str) -> list[tuple[int, int]]:
+    """
+    (hash, time) pairs from the frequency peaks inside a Shazam signature.
+
+    Each peak is paired with the next few peaks: hash = 10-bit anchor frequency,
+    10-bit target frequency, 8-bit time delta; time = the anchor's FFT pass.
+    """
+    from shazamio.signature import DATA_URI_PREFIX, DecodedMessage
+
+    message = DecodedMessage.decode_from_binary(b64decode(signature_uri[len(DATA_URI_PREFIX):]))
+    peaks = sorted(
+        (peak.fft_pass_number, (peak.corrected_peak_frequency_bin >> 6) & 0x3FF)
+        for band in message.frequency_band_to_sound_peaks.values()
+        for peak in band
+    )
+
+    pairs = []
+    for i, (t1, f1) in enumerate(peaks):
+        for t2, f2 in peaks[i + 1:i + 1 + FAN_OUT]:
+            delta = t2 - t1
+            if delta > MAX_DELTA:
+                break
+            pairs.append(((f1 << 18) | (f2 << 8) | delta, t1))
+    return pairs
+
+
+class FingerprintIndex:
+    """Array-backed hash → (track, time) postings with offset-histogram matching"""
+
+    def __init__(self, path: str, min_votes: int, compact_every: int):
+        self.path = path
+        self.min_votes = min_votes
+        self.compact_every = compact_every
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._tracks: list[dict] = []
+        self._track_ids: dict[str, int] = {}
+        self._tracks_offset = 0
+        self._delta: dict[int, list[tuple[int, int]]] = {}
+        self._delta_offset = 0
+        self._delta_tracks: set[int] = set()
+        self._segment = None
+        self._segment_stamp = None
+        self._arrays = None
+        self._checked_at = 0.0
+        os.makedirs(path, exist_ok=True)
+        self._refresh(force=True)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    # --- Loading (also picks up tracks added by other worker processes) ---
+
+    def _refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked_at < 1.0:
+            return
+        self._checked_at = now
+        with self._lock:
+            self._load_segment()
+            self._load_tracks()
+            self._load_delta()
+
+    def _load_segment(self) -> None:
+        try:
+            stat = os.stat(self._file("segment.bin"))
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._segment_stamp:
+            return
+
+        with open(self._file("segment.bin"), "rb") as f:
+            segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(segment)
+        if magic != SEGMENT_MAGIC:
+            segment.close()
+            raise ValueError(f"{self._file('segment.bin')} is not a fingerprint segment")
+
+        view = memoryview(segment)
+        size = count * array("I").itemsize
+        arrays = [
+            view[HEADER.size + i * size:HEADER.size + (i + 1) * size].cast("I")
+            for i in range(3)
+        ]
+        # Old mappings stay valid for in-flight lookups and are freed with their views
+        self._segment, self._arrays, self._segment_stamp = segment, arrays, stamp
+        # The new segment already contains every delta entry written before it
+        self._delta, self._delta_offset, self._delta_tracks = {}, 0, set()
+
+    def _load_tracks(self) -> None:
+        try:
+            with open(self._file("tracks.jsonl"), "rb") as f:
+                f.seek(self._tracks_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        complete = data[:data.rfind(b"\n") + 1]  # Ignore a line still being written
+        for line in complete.splitlines():
+            entry = json.loads(line)
+            self._track_ids[entry["key"]] = len(self._tracks)
+            self._tracks.append(entry["result"])
+        self._tracks_offset += len(complete)
+
+    def _load_delta(self) -> None:
+        try:
+            with open(self._file("delta.bin"), "rb") as f:
+                f.seek(self._delta_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        data = data[:len(data) - len(data) % TRIPLE]
+        triples = array("I", data)
+        for i in range(0, len(triples), 3):
+            hash_, track, when = triples[i:i + 3]
+            self._delta.setdefault(hash_, []).append((track, when))
+            self._delta_tracks.add(track)
+        self._delta_offset += len(data)
+
+    # --- Lookup ---
+
+    def _postings(self, hash_: int):
+        if self._arrays is not None:
+            hashes, tracks, times = self._arrays
+            i = bisect_left(hashes, hash_)
+            while i < len(hashes) and hashes[i] == hash_:
+                yield tracks[i], times[i]
+                i += 1
+        yield from self._delta.get(hash_, ())
+
+    def match(self, signature_uri: str) -> Optional[dict]:
+        """Resolved payload for the track whose landmarks line up best, if enough of them do"""
+        self._refresh()
+        if not self._tracks:
+            return None
+        pairs = landmarks(signature_uri)
+        votes = Counter()
+        with self._lock:
+            for hash_, when in pairs:
+                for track, track_time in self._postings(hash_):
+                    votes[track, (track_time - when) >> OFFSET_BIN] += 1
+            best = votes.most_common(1)
+            if best and best[0][1] >= self.min_votes and best[0][0][0] < len(self._tracks):
+                self.hits += 1
+                return self._tracks[best[0][0][0]]
+        self.misses += 1
+        return None
+
+    # --- Updates ---
+
+    def add(self, signature_uri: str, result: dict) -> None:
+        """Index a signature under an identified track (appends to the delta log)"""
+        pairs = landmarks(signature_uri)
+        if not pairs:
+            return
+        key = result.get("spotify_uri") or f"{result.get('track')}|{result.get('artist')}"
+
+        with self._lock, open(self._file("index.lock"), "w") as lock:
+            # Serialise writers across worker processes, then catch up on their appends
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._refresh(force=True)
+
+            track = self._track_ids.get(key)
+            if track is None:
+                track = len(self._tracks)
+                with open(self._file("tracks.jsonl"), "a") as f:
+                    f.write(json.dumps({"key": key, "result": result}) + "\n")
+                self._load_tracks()
+
+            triples = array("I")
+            for hash_, when in pairs:
+                triples.extend((hash_, track, when))
+            with open(self._file("delta.bin"), "ab") as f:
+                f.write(triples.tobytes())
+            self._load_delta()
+
+            if len(self._delta_tracks) >= self.compact_every:
+                self._compact()
+
+    def _compact(self) -> None:
+        """Merge segment + delta into a new sorted segment and start an empty delta (writer lock held)"""
+        entries = []
+        if self._arrays is not None:
+            entries.extend(zip(*self._arrays))
+        for hash_, postings in self._delta.items():
+            entries.extend((hash_, track, when) for track, when in postings)
+        entries.sort()
+
+        columns = [array("I", (entry[i] for entry in entries)) for i in range(3)]
+        tmp = self._file("segment.bin.tmp")
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(SEGMENT_MAGIC, len(entries)))
+            for column in columns:
+                f.write(column.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._file("segment.bin"))
+        open(self._file("delta.bin"), "wb").close()
+        self._load_segment()
+
+        if settings.ENABLE_DEBUG_LOGS:
+            print(f"🗂️ Fingerprint index compacted: {len(entries)} postings, {len(self._tracks)} tracks")
+
+    def stats(self) -> dict:
+        return {
+            "tracks": len(self._tracks),
+            "segment_postings": len(self._arrays[0]) if self._arrays is not None else 0,
+            "delta_postings": sum(len(postings) for postings in self._delta.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+fingerprint_index = (
+    FingerprintIndex(
+        settings.LOCAL_INDEX_PATH,
+        min_votes=settings.LOCAL_INDEX_MIN_VOTES,
+        compact_every=settings.LOCAL_INDEX_COMPACT_EVERY,
+    )
+    if settings.LOCAL_INDEX_ENABLED
+    else None
+)
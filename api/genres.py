@@ -0,0 +1,140 @@
+"""
+Batched Gemini genre classification
+Collects concurrent genre lookups for a short window and classifies them in one prompt
+"""
+
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from api.cache import normalize_song_key
+from api.clients import gemini_generate
+from api.config import settings
+
+BATCH_PROMPT = (
+    "Classify the primary music genre of each song below. "
+    "Answer with a JSON array containing one object per song, "
+    '{{"id": <song id>, "genre": "<ONE word, e.g. Techno, House, Pop, Rock, Ambient>"}}, '
+    "and nothing else.\n"
+    "Songs:\n{songs}"
+)
+
+
+def parse_genres(text: str) -> dict[int, str]:
+    """Map song id → genre from Gemini's JSON answer (tolerates ```json fences)"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    answers = json.loads(text)
+    if isinstance(answers, dict):
+        answers = answers.get("songs") or answers.get("results") or []
+
+    genres = {}
+    for answer in answers:
+        try:
+            genre = str(answer["genre"]).strip().replace(".", "")
+            if genre:
+                genres[int(answer["id"])] = genre
+        except (KeyError, TypeError, ValueError):
+            continue
+    return genres
+
+
+class GenreBatcher:
+    """
+    Micro-batcher in front of Gemini.
+
+    Callers get a Future per song. A collector thread waits for the first request, then
+    keeps gathering for GENRE_BATCH_WINDOW_MS or until GENRE_BATCH_SIZE songs, and hands
+    the batch to a small pool that sends one prompt and resolves every Future.
+    """
+
+    def __init__(self, max_batch: int, window_ms: int, concurrency: int):
+        self.max_batch = max(1, max_batch)
+        self.window = window_ms / 1000
+        self.batches = 0
+        self.songs = 0
+        self._queue: "queue.Queue[tuple[str, str, Future]]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="stash-genre")
+        self._collector = None
+        self._lock = threading.Lock()
+
+    def classify(self, title: str, artist: str) -> str:
+        """Blocking lookup for sync callers; returns "Unknown" on any failure"""
+        try:
+            return self.submit(title, artist).result(timeout=settings.GENRE_BATCH_TIMEOUT)
+        except Exception as e:
+            print(f"⚠️ Gemini Genre Error: {e}")
+            return "Unknown"
+
+    def submit(self, title: str, artist: str) -> Future:
+        self._ensure_collector()
+        future = Future()
+        self._queue.put((title, artist, future))
+        return future
+
+    def _ensure_collector(self) -> None:
+        if self._collector is None:
+            with self._lock:
+                if self._collector is None:
+                    self._collector = threading.Thread(target=self._collect, name="stash-genre-batcher", daemon=True)
+                    self._collector.start()
+
+    def _collect(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: list) -> None:
+        # Identical songs in one batch share a single id in the prompt
+        ids: dict[str, int] = {}
+        songs = []
+        for title, artist, _ in batch:
+            key = normalize_song_key(title, artist)
+            if key not in ids:
+                ids[key] = len(songs)
+                songs.append({"id": ids[key], "title": title, "artist": artist})
+
+        try:
+            text = gemini_generate(
+                BATCH_PROMPT.format(songs=json.dumps(songs, ensure_ascii=False)),
+                generation_config={"responseMimeType": "application/json"},
+            )
+            genres = parse_genres(text)
+        except Exception as e:
+            print(f"⚠️ Gemini Genre Batch Error ({len(songs)} songs): {e}")
+            genres = {}
+
+        self.batches += 1
+        self.songs += len(songs)
+        if settings.ENABLE_DEBUG_LOGS:
+            print(f"🤖 Genre batch: {len(songs)} songs for {len(batch)} callers")
+
+        for title, artist, future in batch:
+            if not future.done():
+                future.set_result(genres.get(ids[normalize_song_key(title, artist)], "Unknown"))
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "songs": self.songs,
+            "avg_batch_size": round(self.songs / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+genre_batcher = GenreBatcher(
+    max_batch=settings.GENRE_BATCH_SIZE,
+    window_ms=settings.GENRE_BATCH_WINDOW_MS,
+    concurrency=settings.GENRE_BATCH_CONCURRENCY,
+)
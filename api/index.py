@@ -1,194 +1,676 @@
 import os
+import re
 import time
 import json
+import asyncio
 import glob
-from fastapi import FastAPI, HTTPException, Request
+import threading
+from contextlib import asynccontextmanager
+from functools import partial
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import requests
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import yt_dlp
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 import shutil
 
 # Import centralized configuration
 from api.config import settings
+from api.audio import PIPEABLE_PROTOCOLS, ClipSet, StreamSource, has_ffmpeg, make_workdir, plan_windows, sweep_workdirs
+from api.clients import app_spotify, gemini_generate, user_spotify, warm_spotify
+from api.cache import canonical_media_id, genre_cache, normalize_song_key, recognition_cache, spotify_search_cache
+from api.ratelimit import RateLimitMiddleware, client_key, create_backend, hit_async
+from api.scheduler import client_identity, recognition_scheduler
+from api.fingerprint import fingerprinter, window_stats
+from api.fpindex import fingerprint_index
+from api.metadata import declared_song, match_confidence
+from api.cookies import classify_failure, cookie_pool, cookieless_memory, media_domain
+from api.ytdl import download_mode, ydl_pool
+from api.jobs import FINISHED, job_queue
+from api.job_worker import JobWorkerPool
+from api.genres import genre_batcher
+from api.spotify_context import spotify_contexts
+from api.executor import StageOverloaded, download_stage, fingerprint_stage, spotify_stage
+from api.singleflight import SingleFlight
+from api.metrics import CallbackMetric, ServerTimingMiddleware, rate_limited, registry, timed, upstream_errors
+
+# Routes are collected here and mounted by create_app() at the bottom of this module
+router = APIRouter()
+
+# Rate limiting: 10 reels per IP per day, enforced before any download work starts
+rate_limit_backend = create_backend()
+
+async def stage_overloaded_handler(request: Request, exc: StageOverloaded):
+    # Shed load quickly so clients back off instead of queueing behind slow reels
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Stash is busy right now ({exc.stage}). Please retry shortly."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Worker processes draining the async job queue (JOB_WORKERS=0 when they run separately);
+# started with the first queued job, since ?async=true is opt-in
+job_workers = JobWorkerPool(settings.JOB_WORKERS)
+
+async def _supervise_job_workers():
+    # A crashed worker is replaced; the job it held is reclaimed when its lease expires
+    while True:
+        await asyncio.sleep(5)
+        job_workers.check()
+
+def _start_job_workers():
+    if job_workers.ensure_started():
+        _run_in_background(asyncio.ensure_future(_supervise_job_workers()))
+
+async def warm_up():
+    """Pay the first-request costs (token fetch, ffmpeg probe, extractor setup, process forks) up front"""
+    steps = {
+        "spotify_token": warm_spotify,
+        "ffmpeg": has_ffmpeg,
+        "ytdl_pool": partial(ydl_pool.warm, tuple(account.path for account in cookie_pool.accounts)),
+        "fingerprint_pool": fingerprinter.warm,
+    }
 
-# Configure Spotify with validated credentials
-sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
-    client_id=settings.SPOTIFY_CLIENT_ID,
-    client_secret=settings.SPOTIFY_CLIENT_SECRET
-))
-
-app = FastAPI(title="Stash Engine API v1.1.0")
+    async def step(name, fn):
+        try:
+            with timed("startup", name):
+                await asyncio.to_thread(fn)
+        except Exception as e:
+            # A failed step only means that cost is paid by the first request instead
+            print(f"⚠️ Warm-up step {name} failed: {e}")
 
-# Configure CORS with environment-based origins (SECURE)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.ALLOWED_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    try:
+        async with asyncio.timeout(settings.WARMUP_TIMEOUT):
+            await asyncio.gather(*(step(name, fn) for name, fn in steps.items()))
+    except TimeoutError:
+        print(f"⚠️ Warm-up still running after {settings.WARMUP_TIMEOUT}s; reporting ready anyway")
+
+@asynccontextmanager
+async def lifespan(app):
+    settings.validate()
+    if job_workers.count > 0 and await asyncio.to_thread(job_queue.has_work):
+        # Jobs left over from before a restart
+        _start_job_workers()
+    if settings.WARMUP_ENABLED:
+        started = time.perf_counter()
+        await warm_up()
+        print(f"🔥 Warm-up finished in {time.perf_counter() - started:.1f}s")
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        # Stop advertising readiness first so the load balancer drains this process
+        app.state.ready = False
+        await asyncio.to_thread(job_workers.stop)
+        # HTTP requests have drained by now; let downloads/fingerprints still on the stage threads finish
+        await asyncio.gather(*(
+            stage.drain(settings.GRACEFUL_TIMEOUT) for stage in (download_stage, fingerprint_stage, spotify_stage)
+        ))
+        fingerprinter.shutdown()
+        sweep_workdirs()
 
 class ReelRequest(BaseModel):
     url: str
 
-@app.get("/")
+class BatchReelRequest(BaseModel):
+    urls: list[str] = Field(min_length=1, max_length=settings.BATCH_MAX_URLS)
+
+@router.get("/")
 def health_check():
     return {"status": "Antigravity Engine Online 🟢"}
 
+@router.get("/ready")
+def readiness(request: Request):
+    # Liveness is "/"; this only turns 200 once warm-up is done (and 503 again while shutting down)
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "warming up"})
+    return {"status": "ready"}
 
-from shazamio import Shazam
-from collections import defaultdict
-import time
+@router.get("/cache/stats")
+def cache_stats():
+    return {
+        "recognition": recognition_cache.stats(),
+        "spotify_search": spotify_search_cache.stats(),
+        "genre": genre_cache.stats(),
+        "genre_batches": genre_batcher.stats(),
+        "inflight": recognition_flights.stats(),
+        "windows": window_stats.stats(),
+        "local_index": fingerprint_index.stats() if fingerprint_index is not None else None,
+        "cookies": {**cookie_pool.stats(), **cookieless_memory.stats()},
+        "ytdl_pool": ydl_pool.stats(),
+        "jobs": {**job_queue.stats(), **job_workers.stats()},
+        "scheduler": recognition_scheduler.stats(),
+        "spotify_contexts": spotify_contexts.stats(),
+    }
 
-# Rate limiting storage (in-memory for now)
-request_log = defaultdict(list)
+def _cache_lookups():
+    lookups = {}
+    for name, cache in (("recognition", recognition_cache), ("spotify_search", spotify_search_cache), ("genre", genre_cache)):
+        stats = cache.stats()
+        lookups[name, "hit"], lookups[name, "miss"] = stats["hits"], stats["misses"]
+    lookups["spotify_context", "hit"], lookups["spotify_context", "miss"] = spotify_contexts.hits, spotify_contexts.misses
+    if fingerprint_index is not None:
+        lookups["local_index", "hit"], lookups["local_index", "miss"] = fingerprint_index.hits, fingerprint_index.misses
+    return lookups
+
+registry.add(CallbackMetric(
+    "stash_cache_lookups_total", "Cache lookups by cache and result", ("cache", "result"), _cache_lookups,
+))
+registry.add(CallbackMetric(
+    "stash_stage_pending", "Calls admitted to each stage (running + queued)", ("stage",),
+    lambda: {(stage.name,): stage.pending for stage in (download_stage, fingerprint_stage, spotify_stage)},
+    type="gauge",
+))
 
-@app.post("/recognize")
-async def recognize_reel(req: ReelRequest, request: Request):
-    # Get client IP for rate limiting
-    client_ip = "unknown"
-    try:
-        # Try to get real IP from headers (for proxies/load balancers)
-        client_ip = request.headers.get("x-forwarded-for", "unknown").split(",")[0]
-    except:
-        pass
-    
-    # Rate limiting: 10 reels per IP per day
-    now = time.time()
-    request_log[client_ip] = [t for t in request_log[client_ip] if now - t < 86400]  # Keep last 24h
-    
-    if len(request_log[client_ip]) >= settings.RATE_LIMIT_PER_DAY:
-        raise HTTPException(
-            status_code=429, 
-            detail=f"Daily limit reached ({settings.RATE_LIMIT_PER_DAY} reels/day). Upgrade to Pro for unlimited access!"
-        )
-    
-    request_log[client_ip].append(now)
-    
+@router.get("/metrics")
+def metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+# In-flight /recognize runs keyed by canonical media ID
+recognition_flights = SingleFlight("recognition", settings.MAX_INFLIGHT_RECOGNITIONS)
+
+@router.post("/recognize")
+async def recognize_reel(req: ReelRequest, request: Request, async_: bool = Query(False, alias="async")):
+    client, tier = client_identity(request.headers, request.client)
     if settings.ENABLE_DEBUG_LOGS:
-        print(f"🚀 Processing: {req.url} (IP: {client_ip}, Count: {len(request_log[client_ip])})")
+        print(f"🚀 Processing: {req.url} (client: {client}, {tier})")
+
+    # 0. CACHE LOOKUP (viral reels are submitted over and over)
+    media_id = canonical_media_id(req.url)
+    cached = await recognition_cache.aget(media_id)
 
-    # 1. DOWNLOAD AUDIO
-    audio_filename = download_audio(req.url)
-    if not audio_filename:
+    if async_:
+        # Queue it and answer at once; the same reel already queued or done shares one job
+        job, _ = await asyncio.to_thread(job_queue.enqueue, req.url, media_id, cached, client, tier)
+        if job["status"] not in FINISHED:
+            _start_job_workers()
+        return JSONResponse(status_code=200 if job["status"] in FINISHED else 202, content=_job_response(job))
+
+    if cached is not None:
+        if settings.ENABLE_DEBUG_LOGS:
+            print(f"⚡ Cache hit: {media_id}")
+        return cached
+
+    # 1. RUN PIPELINE (concurrent duplicates of the same reel share one run)
+    return await recognition_flights.do(media_id, run_recognition, req.url, media_id, client, tier)
+
+@router.post("/recognize/batch")
+async def recognize_batch(req: BatchReelRequest, request: Request):
+    """
+    Recognize many reels at once, streaming each result as soon as it finishes.
+    Responds with NDJSON, or Server-Sent Events when the client sends Accept: text/event-stream.
+    """
+    # Deduplicate by canonical media ID, remembering which input positions share a reel
+    positions = {}
+    for index, url in enumerate(req.urls):
+        positions.setdefault(canonical_media_id(url), []).append(index)
+
+    if settings.ENABLE_DEBUG_LOGS:
+        print(f"📦 Batch: {len(req.urls)} URLs, {len(positions)} unique reels")
+
+    # The middleware charged one reel for the request; charge the remaining unique reels here
+    client_ip = client_key(request.headers, request.client)
+    client, tier = client_identity(request.headers, request.client)
+    allowed_ids = list(positions)[:1]
+    limited_ids = []
+    for media_id in list(positions)[1:]:
+        allowed, _ = await hit_async(rate_limit_backend, client_ip, settings.RATE_LIMIT_PER_DAY, 86400)
+        (allowed_ids if allowed else limited_ids).append(media_id)
+    if limited_ids:
+        rate_limited.inc(len(limited_ids), path="/recognize/batch")
+
+    async def run_one(media_id):
+        url = req.urls[positions[media_id][0]]
+        try:
+            cached = await recognition_cache.aget(media_id)
+            if cached is not None:
+                return media_id, cached
+            return media_id, await recognition_flights.do(media_id, run_recognition, url, media_id, client, tier)
+        except StageOverloaded as e:
+            return media_id, {"success": False, "error": str(e), "status": 503}
+        except HTTPException as e:
+            return media_id, {"success": False, "error": e.detail, "status": e.status_code}
+        except Exception as e:
+            print(f"❌ Batch Error: {e}")
+            return media_id, {"success": False, "error": str(e), "status": 500}
+
+    use_sse = "text/event-stream" in request.headers.get("accept", "")
+
+    def encode(index, result):
+        line = json.dumps({"index": index, "url": req.urls[index], **result})
+        return f"data: {line}\n\n" if use_sse else f"{line}\n"
+
+    async def stream():
+        limit_error = {
+            "success": False,
+            "error": f"Daily limit reached ({settings.RATE_LIMIT_PER_DAY} reels/day). Upgrade to Pro for unlimited access!",
+            "status": 429,
+        }
+        for media_id in limited_ids:
+            for index in positions[media_id]:
+                yield encode(index, limit_error)
+
+        tasks = [asyncio.ensure_future(run_one(media_id)) for media_id in allowed_ids]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                media_id, result = await next_done
+                for index in positions[media_id]:
+                    yield encode(index, result)
+        finally:
+            # Client went away: stop waiting (shared single-flight work keeps running)
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="text/event-stream" if use_sse else "application/x-ndjson")
+
+def _job_response(job):
+    return {**job, "poll": f"/jobs/{job['job_id']}", "events": f"/jobs/{job['job_id']}/events"}
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return _job_response(job)
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events: one event per status change, closing once the job is done or failed"""
+    if await asyncio.to_thread(job_queue.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+
+    async def stream():
+        last_status = None
+        last_sent = time.monotonic()
+        while True:
+            job = await asyncio.to_thread(job_queue.get, job_id)
+            if job is None:
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                last_sent = time.monotonic()
+                yield f"event: {job['status']}\ndata: {json.dumps(_job_response(job))}\n\n"
+            elif time.monotonic() - last_sent > 15:
+                # Comment line keeps proxies from closing an idle stream
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            if job["status"] in FINISHED:
+                return
+            await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+async def run_recognition(url, media_id, client="anonymous", tier="free"):
+    """Run the pipeline for one reel once the fair scheduler gives `client` a slot"""
+    async with recognition_scheduler.slot(client, tier):
+        return await _recognize(url, media_id)
+
+async def _recognize(url, media_id):
+    """Metadata → (download → fingerprint) → Spotify for one reel. Caches successful results."""
+    # 1. RESOLVE MEDIA (blocking yt-dlp, runs on the download pool; the stream path fetches no audio yet)
+    source = await download_stage.run(download_audio, url)
+    if source is None:
         # Return 422 (Unprocessable Entity) instead of 500 so frontend handles it gracefully
         raise HTTPException(status_code=422, detail="Could not download audio. Instagram/TikTok might be blocking the request. Try a different link.")
 
-    try:
-        # 2. ASK SHAZAM (Audio Fingerprinting)
+    # 2. METADATA FAST PATH (the reel declares its song: straight to Spotify, no fingerprinting)
+    declared = declared_song(source.info) if settings.METADATA_FIRST else None
+    if declared:
+        try:
+            result = await spotify_stage.run(resolve_declared_track, *declared)
+        except Exception as e:
+            # Only a shortcut: a Spotify error or a full stage must not cost us the fingerprint path
+            print(f"⚠️ Metadata fast path failed, fingerprinting instead: {e}")
+            result = {}
+        if result.get("success"):
+            result = {**result, "source": "metadata"}
+            await recognition_cache.aset(media_id, result)
+            return result
         if settings.ENABLE_DEBUG_LOGS:
-            print(f"🎵 Fingerprinting with Shazam: {audio_filename}")
-        shazam = Shazam()
-        
-        # Shazam requires ffmpeg or compatible file. Our download_audio handles this.
-        out = await shazam.recognize(audio_filename)
-        
-        # Cleanup audio immediately
-        if os.path.exists(audio_filename): os.remove(audio_filename)
+            print(f"🏷️ Declared song not confirmed on Spotify, fingerprinting instead: {declared[0]} by {declared[1]}")
 
-        # 3. PARSE SHAZAM RESULT
-        if not out.get('matches'):
-            if settings.ENABLE_DEBUG_LOGS:
-                print("❌ Shazam found no matches.")
-            return {"success": False, "error": "Could not identify song from audio"}
+    # 3. ASK SHAZAM (Audio Fingerprinting over several windows, first match wins)
+    out, sig = await recognize_windows(source)
+    if out.get('local'):
+        # Song we've identified before: answered from the local index, no Shazam/Spotify calls
+        if settings.ENABLE_DEBUG_LOGS:
+            print(f"🗂️ Local index match: {out['local']['track']} by {out['local']['artist']}")
+        result = {**out['local'], "source": "local_index"}
+        await recognition_cache.aset(media_id, result)
+        return result
 
+    # 4. PARSE SHAZAM RESULT
+    if not out.get('matches'):
+        return {"success": False, "error": "Could not identify song from audio"}
+
+    try:
         track_info = out['track']
         shazam_title = track_info['title']
         shazam_artist = track_info['subtitle']
-        
+
         if settings.ENABLE_DEBUG_LOGS:
             print(f"🎯 Shazam Match: {shazam_title} by {shazam_artist}")
 
-        # 4. VERIFY WITH SPOTIFY (Get Playable URI)
-        # We still search Spotify to get the URI for the frontend player/saving
-        return search_spotify_strict(shazam_title, shazam_artist)
-
+        # 5. VERIFY WITH SPOTIFY (Get Playable URI)
+        # Prefer Shazam's own Spotify link / ISRC over a free-text search
+        result = await spotify_stage.run(resolve_spotify_track, track_info)
+        if result.get("success"):
+            result = {**result, "source": "fingerprint"}
+            await recognition_cache.aset(media_id, result)
+            if fingerprint_index is not None and sig is not None:
+                _run_in_background(asyncio.ensure_future(asyncio.to_thread(_index_signature, sig, result)))
+        return result
+
+    except StageOverloaded:
+        raise
     except Exception as e:
         print(f"❌ Error: {e}")
-        if audio_filename and os.path.exists(audio_filename): os.remove(audio_filename)
         raise HTTPException(status_code=500, detail=str(e))
 
+async def recognize_windows(source):
+    """
+    Fingerprint every planned window (start/middle/end) in parallel and return the first
+    match with its signature, cancelling the rest (their ffmpeg reads are killed; a signature
+    already computing in the pool still finishes). Gives up after FINGERPRINT_BUDGET seconds.
+    A local index hit comes back as {"local": <cached result>}.
+    """
+    async def fingerprint(audio):
+        # Signature is computed in the process pool; Shazam is only asked on a local index miss
+        sig = await fingerprinter.signature(audio)
+        if fingerprint_index is not None:
+            try:
+                local = await asyncio.to_thread(fingerprint_index.match, sig.signature.uri)
+            except Exception as e:
+                print(f"⚠️ Local index lookup failed: {e}")
+                local = None
+            if local:
+                return {"local": local}, sig
+        return await fingerprinter.lookup(sig), sig
+
+    async def attempt(position):
+        started = time.monotonic()
+        stop = threading.Event()
+        try:
+            audio = await download_stage.run(source.read, position, stop)
+        except asyncio.CancelledError:
+            # Cancelling only stops the wait; tell the worker thread to kill its ffmpeg
+            stop.set()
+            raise
+        if not audio:
+            return position, {}, None, started
+        if settings.ENABLE_DEBUG_LOGS:
+            print(f"🎵 Fingerprinting with Shazam ({position} window): {len(audio) // 1024} KB")
+        out, sig = await fingerprint_stage.run_async(fingerprint, audio)
+        return position, out, sig, started
+
+    tasks = {asyncio.ensure_future(attempt(position)): position for position in source.windows}
+    pending = set(tasks)
+    errors = []
+    overloaded = []
+    try:
+        async with asyncio.timeout(settings.FINGERPRINT_BUDGET):
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                match = None
+                # Look at every finished window, even after a match, so no exception goes unretrieved
+                for task in done:
+                    error = task.exception()
+                    if isinstance(error, StageOverloaded):
+                        # A window that wasn't admitted is just one fewer chance; its siblings may still match
+                        overloaded.append(error)
+                        continue
+                    if error is not None:
+                        print(f"❌ Error ({tasks[task]} window): {error}")
+                        errors.append(error)
+                        continue
+
+                    position, out, sig, started = task.result()
+                    matched = bool(out.get('matches') or out.get('local'))
+                    window_stats.record(position, matched, time.monotonic() - started)
+                    if matched and match is None:
+                        window_stats.record_win(position)
+                        match = out, sig
+                    elif not matched and settings.ENABLE_DEBUG_LOGS:
+                        print(f"❌ Shazam found no matches in the {position} window.")
+                if match:
+                    return match
+    except TimeoutError:
+        print(f"⏱️ Fingerprint budget ({settings.FINGERPRINT_BUDGET}s) exhausted")
+    finally:
+        for task in pending:
+            window_stats.record_cancelled(tasks[task])
+            task.cancel()
+
+    if overloaded and len(overloaded) == len(tasks):
+        # Not a single window got into the pipeline: tell the client to come back later
+        raise overloaded[0]
+    if errors and len(errors) + len(overloaded) == len(tasks):
+        raise HTTPException(status_code=500, detail=str(errors[0]))
+    return {}, None
+
+def _index_signature(sig, result):
+    """Remember an identified signature so the next reel with this song is answered locally."""
+    try:
+        fingerprint_index.add(sig.signature.uri, result)
+    except Exception as e:
+        print(f"⚠️ Local index update failed: {e}")
+
+def _clip_ranges(windows):
+    """yt-dlp download_ranges callback cutting every planned window; fills `windows` with position → section."""
+    def ranges(info_dict, ydl):
+        windows.update(plan_windows(info_dict.get('duration'), settings.FINGERPRINT_WINDOWS))
+        for start, end in windows.values():
+            yield {'start_time': start, 'end_time': end}
+    return ranges
+
 def download_audio(url):
-    """Downloads Instagram audio to /tmp. Tries without cookies first (public posts), then with cookies."""
-    
+    """
+    Resolves reel audio to an in-memory source of fingerprint windows. Tries without cookies
+    first (public posts) unless the domain is known to need them and an account is free,
+    then with a pooled account.
+    """
+    domain = media_domain(url)
+
+    # Skip the cookieless attempt only if we actually have an account to go straight to;
+    # with no accounts (or all of them cooling down) it's still the only chance
+    account = None
+    if not cookieless_memory.should_try(domain):
+        account = cookie_pool.acquire(timeout=settings.COOKIE_ACQUIRE_TIMEOUT)
+        if account is not None and settings.ENABLE_DEBUG_LOGS:
+            print(f"🔐 {domain} needs cookies lately; skipping the cookieless attempt")
+
     # Try WITHOUT cookies first (works for public posts)
-    result = _download_with_options(url, use_cookies=False)
-    
-    # If failed, retry WITH cookies (for private/restricted posts)
-    if not result:
+    if account is None:
+        with timed("download", "cookieless"):
+            result, error = _download_with_options(url)
+        cookieless_memory.record(domain, "ok" if result else classify_failure(error))
+        if result:
+            return result
         print("⚠️ Cookieless download failed. Retrying with authentication...")
-        result = _download_with_options(url, use_cookies=True)
-    
+
+        # Retry WITH cookies (for private/restricted posts)
+        account = cookie_pool.acquire(timeout=settings.COOKIE_ACQUIRE_TIMEOUT)
+        if account is None:
+            if cookie_pool.accounts:
+                print("⚠️ No cookie account available (all busy or cooling down)")
+            return None
+
+    if settings.ENABLE_DEBUG_LOGS:
+        print(f"🍪 Using cookie account #{account.number} (Pool: {len(cookie_pool.accounts)} accounts)")
+    result, error = None, None
+    try:
+        with timed("download", "cookie"):
+            result, error = _download_with_options(url, cookie_file=account.path)
+    finally:
+        cookie_pool.release(account, "ok" if result else classify_failure(error))
     return result
 
-def _download_with_options(url, use_cookies=False):
-    """Internal function to download with or without cookies."""
+def _download_with_options(url, cookie_file=None):
+    """Internal function to download with or without cookies. Returns (source, error)."""
+    workdir = None
     try:
-        filename = f"/tmp/temp_{int(time.time())}"
-        has_ffmpeg = shutil.which("ffmpeg") is not None
+        if not cookie_file and settings.ENABLE_DEBUG_LOGS:
+            print("🌐 Trying cookieless download (public post)...")
+
+        if has_ffmpeg() and settings.CLIP_ENABLED:
+            # Fast path: resolve the stream URL once; windows are piped through ffmpeg on demand
+            source = _stream_source(url, cookie_file)
+            if source is not None:
+                return source, None
+
+        # Disk fallback: unique temp dir per request, always removed afterwards
+        workdir = make_workdir()
+        mode = download_mode()
+        windows = {}
+        params = {'paths': {'home': workdir}}
+        if mode == 'clip':
+            # Fingerprint clips: fetch only the windows (ffmpeg input seeking) and
+            # write small mono low-rate WAVs instead of transcoding the whole file
+            params['download_ranges'] = _clip_ranges(windows)
+
+        with ydl_pool.checkout(mode, cookie_file, **params) as ydl:
+            info = ydl.extract_info(url, download=True)
         
-        ydl_opts = {
-            'quiet': False, 
-            'no_warnings': False,
-            'nocheckcertificate': True,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 14_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Sec-Fetch-Mode': 'navigate',
-            }
-        }
-
-        # Add cookies with rotation support
-        if use_cookies and settings.YTDLP_COOKIES:
-            import random
-            
-            # Randomly select from available cookies for load distribution
-            cookies_content = random.choice(settings.YTDLP_COOKIES)
-            cookie_file = '/tmp/cookies.txt'
-            
-            try:
-                with open(cookie_file, 'w') as f:
-                    f.write(cookies_content)
-                ydl_opts['cookiefile'] = cookie_file
-                
-                if settings.ENABLE_DEBUG_LOGS:
-                    cookie_index = settings.YTDLP_COOKIES.index(cookies_content) + 1
-                    print(f"🍪 Using cookie account #{cookie_index} (Pool: {len(settings.YTDLP_COOKIES)} accounts)")
-            except Exception as e:
-                print(f"⚠️ Cookie file creation failed: {e}")
-        else:
-            if settings.ENABLE_DEBUG_LOGS:
-                print("🌐 Trying cookieless download (public post)...")
-
-        if has_ffmpeg:
-            ydl_opts.update({
-                'format': 'bestaudio/best',
-                'outtmpl': filename,
-                'postprocessors': [{'key': 'FFmpegExtractAudio','preferredcodec': 'mp3'}],
-            })
+        clips = {}
+        if windows:
+            for position, (start, _) in windows.items():
+                files = glob.glob(os.path.join(workdir, f"audio_{int(start)}.*"))
+                if files:
+                    with open(files[0], 'rb') as f:
+                        clips[position] = f.read()
         else:
-            ydl_opts.update({
-                'format': 'bestaudio',
-                'outtmpl': f"{filename}.%(ext)s",
-            })
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-        
-        files = glob.glob(f"{filename}*")
-        return files[0] if files else None
+            # Whole-file download (no clip mode): a single "start" window
+            files = glob.glob(os.path.join(workdir, "audio*"))
+            if files:
+                with open(files[0], 'rb') as f:
+                    clips["start"] = f.read()
+        if not clips:
+            return None, None
+        return ClipSet(clips, _reel_metadata(info)), None
     except Exception as e:
         print(f"Download Error: {e}")
-        return None
+        upstream_errors.inc(upstream="download")
+        return None, e
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def _stream_source(url, cookie_file=None):
+    """Resolve the best audio stream without downloading it. Returns None when it can't be piped (caller falls back to disk)."""
+    with ydl_pool.checkout('probe', cookie_file) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    if info.get('protocol') not in PIPEABLE_PROTOCOLS or not info.get('url'):
+        return None  # Fragmented/DASH formats go through yt-dlp's own downloader
+    return StreamSource(info['url'], info.get('http_headers'), info.get('duration'), _reel_metadata(info))
+
+def _reel_metadata(info):
+    """The extractor fields the metadata fast path looks at."""
+    fields = ("track", "artist", "artists", "album", "uploader", "uploader_id", "channel")
+    return {field: info.get(field) for field in fields if info and info.get(field)}
+
+def resolve_spotify_track(shazam_track):
+    """
+    Map a Shazam match to a Spotify track, cheapest lookup first:
+    (1) a direct spotify:track URI in Shazam's provider data, (2) an isrc: search,
+    (3) the fuzzy title/artist search. Results are cached by Shazam key and by song.
+    """
+    title = shazam_track['title']
+    artist = shazam_track['subtitle']
+    keys = [f"song:{normalize_song_key(title, artist)}"]
+    if shazam_track.get('key'):
+        keys.insert(0, f"shazam:{shazam_track['key']}")
+
+    for key in keys:
+        cached = spotify_search_cache.get(key)
+        if cached is not None:
+            if settings.ENABLE_DEBUG_LOGS:
+                print(f"⚡ Spotify cache hit ({key})")
+            return cached
+
+    result = None
+    track_id = _spotify_track_id_from_shazam(shazam_track)
+    if track_id:
+        try:
+            result = _format_spotify_track(app_spotify().track(track_id))
+            if settings.ENABLE_DEBUG_LOGS:
+                print(f"🔗 Spotify via Shazam provider link: {result['track']} by {result['artist']}")
+        except Exception as e:
+            print(f"⚠️ Spotify provider lookup failed: {e}")
+
+    if result is None and shazam_track.get('isrc'):
+        try:
+            items = app_spotify().search(q=f"isrc:{shazam_track['isrc']}", type='track', limit=5)['tracks']['items']
+            if items:
+                best = max(items, key=lambda x: x['popularity'])
+                result = _format_spotify_track(best)
+                if settings.ENABLE_DEBUG_LOGS:
+                    print(f"🔖 Spotify via ISRC {shazam_track['isrc']}: {result['track']} by {result['artist']}")
+        except Exception as e:
+            print(f"⚠️ Spotify ISRC lookup failed: {e}")
+
+    if result is None:
+        result = search_spotify_strict(title, artist)
+
+    if result.get("success"):
+        for key in keys:
+            spotify_search_cache.set(key, result)
+    return result
+
+def _spotify_track_id_from_shazam(shazam_track):
+    """Spotify track ID from Shazam's hub providers/options, if it carries a direct link"""
+    hub = shazam_track.get('hub') or {}
+    actions = [action for provider in hub.get('providers') or [] for action in provider.get('actions') or []]
+    actions += [action for option in hub.get('options') or [] for action in option.get('actions') or []]
+    for action in actions:
+        uri = action.get('uri') or ""
+        if uri.startswith("spotify:track:"):
+            return uri.rsplit(":", 1)[1]
+        match = re.search(r"open\.spotify\.com/track/([A-Za-z0-9]{22})", uri)
+        if match:
+            return match.group(1)
+    return None
+
+def _format_spotify_track(best):
+    return {
+        "success": True,
+        "track": best['name'],
+        "artist": best['artists'][0]['name'],
+        "album_art": best['album']['images'][0]['url'] if best['album'].get('images') else None,
+        "spotify_uri": best['uri'],
+        "spotify_url": best['external_urls']['spotify'],
+        "preview_url": best.get('preview_url'), 
+        "confidence": 0.99
+    }
+
+def resolve_declared_track(track, artist):
+    """
+    Spotify track for a song the reel declares in its metadata. Stricter than the Shazam path:
+    the artist must be credited and the title must match, otherwise we fingerprint instead.
+    """
+    key = f"declared:{normalize_song_key(track, artist)}"
+    cached = spotify_search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    items = app_spotify().search(q=f"{track} {artist}", type='track', limit=10)['tracks']['items']
+    scored = [(match_confidence(track, artist, item), item) for item in items]
+    scored = [(confidence, item) for confidence, item in scored if confidence]
+    if not scored:
+        return {"success": False, "error": "Declared song not found on Spotify"}
+
+    confidence, best = max(scored, key=lambda x: (x[0], x[1]['popularity']))
+    result = {**_format_spotify_track(best), "confidence": confidence}
+    if settings.ENABLE_DEBUG_LOGS:
+        print(f"🏷️ Spotify via reel metadata: {result['track']} by {result['artist']}")
+    spotify_search_cache.set(key, result)
+    return result
 
 def search_spotify_strict(track, artist):
     # Search with keywords (broader than strict field match, but sorted by popularity)
     query = f"{track} {artist}" 
-    results = sp.search(q=query, type='track', limit=10)  # Get more results to filter
+    results = app_spotify().search(q=query, type='track', limit=10)  # Get more results to filter
     items = results['tracks']['items']
     
     if not items: return {"success": False, "error": "Not found on Spotify"}
@@ -217,16 +699,7 @@ def search_spotify_strict(track, artist):
     if settings.ENABLE_DEBUG_LOGS:
         print(f"🎯 Spotify Match (Popularity {best['popularity']}): {best['name']} by {best['artists'][0]['name']}")
 
-    return {
-        "success": True,
-        "track": best['name'],
-        "artist": best['artists'][0]['name'],
-        "album_art": best['album']['images'][0]['url'],
-        "spotify_uri": best['uri'],
-        "spotify_url": best['external_urls']['spotify'],
-        "preview_url": best.get('preview_url'), 
-        "confidence": 0.99
-    }
+    return _format_spotify_track(best)
 
 class SaveWebTrackRequest(BaseModel):
     token: str
@@ -239,32 +712,73 @@ class RemoveTrackRequest(BaseModel):
     playlist_id: str = "1"  # Default to liked songs
 
 # Helper: AI Genre Detection
-def detect_genre_with_gemini(track_name, artist_name):
-    """Detect music genre using Gemini AI"""
+async def detect_genre_with_gemini(track_name, artist_name, track_id=None):
+    """Detect music genre using Gemini AI, cached per track (repeat saves skip the LLM)"""
+    if not settings.ENABLE_GENRE_DETECTION:
+        return "Unknown"
+
+    keys = _genre_keys(track_id, track_name, artist_name)
+    cached = await _cached_genre(keys)
+    if cached is not None:
+        return cached
+
+    # Concurrent saves are folded into one batched Gemini prompt
     try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={settings.GEMINI_API_KEY}"
-        prompt = f"What is the primary music genre of the song '{track_name}' by '{artist_name}'? Return only ONE word (e.g., Techno, House, Pop, Rock, Ambient). Do not write sentences."
-        
-        payload = {
-            "contents": [{
-                "parts": [{"text": prompt}]
-            }]
-        }
-        
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        
-        vibe = data['candidates'][0]['content']['parts'][0]['text'].strip().replace(".", "")
-        return vibe
+        genre = await asyncio.wait_for(
+            asyncio.wrap_future(genre_batcher.submit(track_name, artist_name)),
+            timeout=settings.GENRE_BATCH_TIMEOUT,
+        )
     except Exception as e:
         print(f"⚠️ Gemini Genre Error: {e}")
+        genre = "Unknown"
+
+    # "Unknown" is usually a transient failure, so only remember it briefly
+    ttl = settings.GENRE_NEGATIVE_TTL if genre == "Unknown" else None
+    for key in keys:
+        await genre_cache.aset(key, genre, ttl)
+    return genre
+
+def _genre_keys(track_id, track_name=None, artist_name=None):
+    keys = []
+    if track_id:
+        keys.append(f"track:{track_id}")
+    if track_name is not None:
+        keys.append(f"song:{normalize_song_key(track_name, artist_name)}")
+    return keys
+
+async def _cached_genre(keys):
+    for key in keys:
+        cached = await genre_cache.aget(key)
+        if cached is not None:
+            if settings.ENABLE_DEBUG_LOGS:
+                print(f"⚡ Genre cache hit ({key}): {cached}")
+            return cached
+    return None
+
+async def _genre_for_track(user_sp, track_id):
+    """Genre for a Spotify track; skips the track() lookup entirely on a track-ID cache hit"""
+    try:
+        if settings.ENABLE_GENRE_DETECTION:
+            cached = await _cached_genre(_genre_keys(track_id))
+            if cached is not None:
+                return cached
+        track_info = await spotify_stage.run(user_sp.track, track_id)
+        return await detect_genre_with_gemini(track_info['name'], track_info['artists'][0]['name'], track_id)
+    except Exception as e:
+        print(f"⚠️ Genre lookup failed: {e}")
         return "Unknown"
 
+# Strong references to fire-and-forget tasks so they aren't garbage-collected mid-flight
+_background_tasks = set()
+
+def _run_in_background(task):
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
 class AnalyzeVibeRequest(BaseModel):
     songs: list[str] # List of "Song - Artist" strings
 
-@app.post("/analyze_vibe")
+@router.post("/analyze_vibe")
 def analyze_vibe_summary(request: AnalyzeVibeRequest):
     """Analyze user's music vibe using AI"""
     if settings.ENABLE_DEBUG_LOGS:
@@ -273,21 +787,10 @@ def analyze_vibe_summary(request: AnalyzeVibeRequest):
         return {"vibe": "No music yet! Start stashing to find your vibe."}
     
     try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GEMINI_API_KEY}"
         song_list = ", ".join(request.songs[:20]) # Limit to last 20 to save tokens
         prompt = f"Here is a user's recently liked music: {song_list}. In one short, fun sentence (max 10 words), describe their current 'music vibe' or mood. Be creative like Spotify Wrapped. Example: 'Melancholic late-night techno drive by yourself.'"
         
-        payload = {
-            "contents": [{
-                "parts": [{"text": prompt}]
-            }]
-        }
-        
-        res = requests.post(url, json=payload)
-        res.raise_for_status()
-        data = res.json()
-        
-        vibe = data['candidates'][0]['content']['parts'][0]['text'].strip()
+        vibe = gemini_generate(prompt).strip()
         if settings.ENABLE_DEBUG_LOGS:
             print(f"✨ Vibe Result: {vibe}")
         return {"vibe": vibe}
@@ -295,71 +798,81 @@ def analyze_vibe_summary(request: AnalyzeVibeRequest):
         print(f"❌ Vibe Error: {e}")
         return {"vibe": "Eclectic and mysterious."}
 
-@app.post("/save_track")
-def save_track_to_spotify(request: SaveWebTrackRequest):
+@router.post("/save_track")
+async def save_track_to_spotify(request: SaveWebTrackRequest):
     """Save track to Spotify library or playlist"""
+    from spotipy.exceptions import SpotifyException  # spotipy is only imported once a client is built
     if settings.ENABLE_DEBUG_LOGS:
         print(f"💾 Saving Track: {request.track_id} to Playlist: {request.playlist_id}")
     
+    smart_sort = request.playlist_id == "smart_sort"
+    context_task = None
+    genre_task = None
     try:
-        # 1. Initialize User Context
-        user_sp = spotipy.Spotify(auth=request.token)
-        user_id = user_sp.current_user()['id']
-        
+        # 1. Start independent lookups concurrently: user context (user ID + playlist
+        #    index) and genre (track metadata → Gemini, skipped on a cache hit)
+        user_sp = user_spotify(request.token)
         target_playlist_id = request.playlist_id
-        
-        # Always get track info first
-        track_info = user_sp.track(request.track_id)
-        track_name = track_info['name']
-        artist_name = track_info['artists'][0]['name']
-
-        # 2. Detect Genre (Always run this now for Analytics)
-        genre = detect_genre_with_gemini(track_name, artist_name)
-        print(f"🤖 Genre: {genre}")
-        
-        playlist_name = "Stash: " + genre
+        genre_task = asyncio.create_task(_genre_for_track(user_sp, request.track_id))
+        if smart_sort:
+            context_task = asyncio.create_task(spotify_stage.run(spotify_contexts.get, user_sp, request.token))
 
-        # 3. Smart Sort Logic (Playlist overriding)
-        if request.playlist_id == "smart_sort":
+        # 2. Smart Sort Logic (Playlist overriding) — the only path that needs the genre up front
+        if smart_sort:
             print("🧠 Smart Sort Engaged.")
+            genre = await genre_task
+            print(f"🤖 Genre: {genre}")
+            playlist_name = "Stash: " + genre
+            context = await context_task
             
-            # Find/Create Playlist
-            playlists = user_sp.current_user_playlists(limit=50)
-            existing_id = None
-            for p in playlists['items']:
-                if p['name'].lower() == playlist_name.lower():
-                    existing_id = p['id']
-                    break
-            
-            if existing_id:
-                target_playlist_id = existing_id
-                print(f"📂 Found existing playlist: {playlist_name}")
-            else:
-                new_playlist = user_sp.user_playlist_create(user_id, playlist_name, public=False)
-                target_playlist_id = new_playlist['id']
+            # Find/Create Playlist from the cached index
+            target_playlist_id, created = await spotify_stage.run(spotify_contexts.find_or_create, user_sp, context, playlist_name)
+            if created:
                 print(f"✨ Created new playlist: {playlist_name}")
+            else:
+                print(f"📂 Found existing playlist: {playlist_name}")
 
-        # 4. Add Track to Target Playlist
-        final_playlist_name = "Liked Songs"
-        
-        if target_playlist_id and target_playlist_id != '1':
-             user_sp.playlist_add_items(target_playlist_id, [f"spotify:track:{request.track_id}"])
-             
-             # If it was Smart Sort, we already have the name
-             if request.playlist_id == "smart_sort":
-                 final_playlist_name = playlist_name
-             else:
-                 # Fetch name for custom ID
-                 try:
-                     pl_details = user_sp.playlist(target_playlist_id)
-                     final_playlist_name = pl_details['name']
-                 except:
-                     final_playlist_name = "Selected Playlist"
-                     
-             print(f"✅ Added to playlist: {final_playlist_name} ({target_playlist_id})")
+            try:
+                await spotify_stage.run(user_sp.playlist_add_items, target_playlist_id, [f"spotify:track:{request.track_id}"])
+            except SpotifyException as e:
+                if e.http_status != 404:
+                    raise
+                # Cached playlist was deleted on Spotify's side: drop it and recreate once
+                context.forget(target_playlist_id)
+                target_playlist_id, _ = await spotify_stage.run(spotify_contexts.find_or_create, user_sp, context, playlist_name)
+                await spotify_stage.run(user_sp.playlist_add_items, target_playlist_id, [f"spotify:track:{request.track_id}"])
+
+            final_playlist_name = playlist_name
+            print(f"✅ Added to playlist: {final_playlist_name} ({target_playlist_id})")
+
+        # 3. Add Track to Target Playlist
+        elif target_playlist_id and target_playlist_id != '1':
+            await spotify_stage.run(user_sp.playlist_add_items, target_playlist_id, [f"spotify:track:{request.track_id}"])
+
+            # Custom ID: the track is already added, so the name is best effort. Use the
+            # cached index if we have one, otherwise fetch just this playlist's name
+            try:
+                context = spotify_contexts.peek(request.token)
+                final_playlist_name = context.name_of(target_playlist_id) if context else None
+                if not final_playlist_name:
+                    pl_details = await spotify_stage.run(user_sp.playlist, target_playlist_id, fields="name")
+                    final_playlist_name = pl_details['name']
+            except Exception:
+                final_playlist_name = "Selected Playlist"
+            print(f"✅ Added to playlist: {final_playlist_name} ({target_playlist_id})")
         else:
-             user_sp.current_user_saved_tracks_add([request.track_id])
-             print("✅ Added to Liked Songs")
+            await spotify_stage.run(user_sp.current_user_saved_tracks_add, [request.track_id])
+            final_playlist_name = "Liked Songs"
+            print("✅ Added to Liked Songs")
+
+        # 4. Genre for analytics (the client stores it with the save): give an uncached genre
+        #    SAVE_GENRE_WAIT seconds, then let it finish (and warm the cache) in the background
+        if not smart_sort:
+            try:
+                genre = await asyncio.wait_for(asyncio.shield(genre_task), settings.SAVE_GENRE_WAIT)
+            except asyncio.TimeoutError:
+                _run_in_background(genre_task)
+                genre = "Unknown"
 
         return {
             "success": True, 
@@ -368,11 +881,16 @@ def save_track_to_spotify(request: SaveWebTrackRequest):
             "genre": genre 
         }
 
+    except StageOverloaded:
+        raise
     except Exception as e:
         print(f"❌ Save Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if context_task and not context_task.done():
+            context_task.cancel()
 
-@app.post("/remove_track")
+@router.post("/remove_track")
 def remove_track_from_spotify(request: RemoveTrackRequest):
     """Remove track from Spotify library and/or playlist"""
     if settings.ENABLE_DEBUG_LOGS:
@@ -380,7 +898,7 @@ def remove_track_from_spotify(request: RemoveTrackRequest):
     
     try:
         # Initialize User Context
-        user_sp = spotipy.Spotify(auth=request.token)
+        user_sp = user_spotify(request.token)
         
         # Always remove from Liked Songs
         try:
@@ -410,3 +928,35 @@ def remove_track_from_spotify(request: RemoveTrackRequest):
     except Exception as e:
         print(f"❌ Remove Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="Stash Engine API v1.1.0", lifespan=lifespan)
+    app.state.ready = False
+
+    # Per-request stage timings as a Server-Timing header (innermost, so it sees the endpoint's work)
+    if settings.SERVER_TIMING:
+        app.add_middleware(ServerTimingMiddleware)
+
+    # Added before CORS so 429 responses still carry CORS headers
+    app.add_middleware(
+        RateLimitMiddleware,
+        backend=rate_limit_backend,
+        paths={"/recognize", "/recognize/batch"},
+        limit=settings.RATE_LIMIT_PER_DAY,
+        window=86400,
+    )
+
+    # Configure CORS with environment-based origins (SECURE)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.ALLOWED_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.add_exception_handler(StageOverloaded, stage_overloaded_handler)
+    app.include_router(router)
+    return app
+
+app = create_app()
@@ -0,0 +1,141 @@
+"""
+Recognition job workers for Stash API
+Drain the SQLite job queue in separate processes, so queued reels don't compete with the API for its event loop
+Started by the API (JOB_WORKERS), or standalone with `python -m api.job_worker`
+"""
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+
+from fastapi import HTTPException
+
+from api.config import settings
+from api.executor import StageOverloaded
+from api.jobs import job_queue
+
+# Seconds a stopping worker gets to finish its current jobs before it is killed
+# (anything cut short is picked up again once its lease expires)
+STOP_TIMEOUT = 10
+
+
+async def _heartbeat(job: dict, worker: str) -> None:
+    while True:
+        await asyncio.sleep(settings.JOB_LEASE_SECONDS / 3)
+        if not await asyncio.to_thread(job_queue.heartbeat, job["job_id"], worker):
+            print(f"⚠️ Job {job['job_id']} was reclaimed from {worker}")
+            return
+
+
+async def _run_job(job: dict, worker: str) -> None:
+    # Imported here: api.index starts the workers, and spawned children only need it once they run jobs
+    from api.cache import recognition_cache
+    from api.index import run_recognition
+
+    heartbeat = asyncio.create_task(_heartbeat(job, worker))
+    try:
+        result = await recognition_cache.aget(job["media_id"])
+        if result is None:
+            result = await run_recognition(job["url"], job["media_id"], job["client"], job["tier"])
+    except StageOverloaded as e:
+        await asyncio.to_thread(job_queue.fail, job["job_id"], worker, str(e), 503, retry_after=e.retry_after)
+    except HTTPException as e:
+        await asyncio.to_thread(job_queue.fail, job["job_id"], worker, e.detail, e.status_code)
+    except Exception as e:
+        print(f"❌ Job {job['job_id']} failed: {e}")
+        await asyncio.to_thread(job_queue.fail, job["job_id"], worker, str(e), 500)
+    else:
+        await asyncio.to_thread(job_queue.complete, job["job_id"], worker, result)
+    finally:
+        heartbeat.cancel()
+
+
+async def _claim_loop(worker: str, stopping: asyncio.Event) -> None:
+    while not stopping.is_set():
+        job = await asyncio.to_thread(job_queue.claim, worker)
+        if job is None:
+            try:
+                await asyncio.wait_for(stopping.wait(), settings.JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        if settings.ENABLE_DEBUG_LOGS:
+            print(f"🧾 {worker} took job {job['job_id']} (attempt {job['attempt']}): {job['url']}")
+        await _run_job(job, worker)
+
+
+async def _drain() -> None:
+    from api.fingerprint import fingerprinter
+
+    # Every job worker is its own process already; keep each one's signature pool small
+    fingerprinter.processes = settings.JOB_FINGERPRINT_PROCESSES
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"🧾 Job worker {worker} started ({settings.JOB_WORKER_CONCURRENCY} slots)")
+    await asyncio.gather(*(_claim_loop(worker, stopping) for _ in range(settings.JOB_WORKER_CONCURRENCY)))
+
+
+def worker_main() -> None:
+    asyncio.run(_drain())
+
+
+class JobWorkerPool:
+    """
+    The API's job worker processes; dead workers are replaced by check().
+    Async jobs are opt-in, so callers start the pool once there is a job to run.
+    """
+
+    def __init__(self, count: int):
+        self.count = count
+        self.restarts = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: list = []
+
+    def _spawn(self, number: int):
+        process = self._context.Process(target=worker_main, name=f"stash-job-worker-{number}")
+        process.start()
+        return process
+
+    @property
+    def started(self) -> bool:
+        return bool(self._processes)
+
+    def start(self) -> None:
+        self._processes = [self._spawn(number) for number in range(self.count)]
+
+    def ensure_started(self) -> bool:
+        """Start the workers unless they are running already; True if this call started them"""
+        if self.started or self.count <= 0:
+            return False
+        self.start()
+        return True
+
+    def check(self) -> None:
+        for number, process in enumerate(self._processes):
+            if not process.is_alive():
+                print(f"⚠️ Job worker {process.name} exited ({process.exitcode}); restarting")
+                self._processes[number] = self._spawn(number)
+                self.restarts += 1
+
+    def stop(self) -> None:
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join(STOP_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+        self._processes = []
+
+    def stats(self) -> dict:
+        return {"workers": sum(process.is_alive() for process in self._processes), "restarts": self.restarts}
+
+
+if __name__ == "__main__":
+    worker_main()
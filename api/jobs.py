@@ -0,0 +1,220 @@
+"""
+Durable recognition job queue for Stash API
+SQLite-backed, shared by the API process (enqueue, poll) and the job workers (claim, complete)
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+from api.config import settings
+
+FINISHED = ("done", "failed")
+
+
+class JobQueue:
+    """
+    Jobs are claimed with a lease. A worker that dies stops renewing it, and once
+    the lease runs out the job is handed to the next worker (up to JOB_MAX_ATTEMPTS).
+    """
+
+    def __init__(self, path: str, lease: float, max_attempts: int, retention: float):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self._local = threading.local()
+        self._next_prune = 0.0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, media_id TEXT NOT NULL, url TEXT NOT NULL, status TEXT NOT NULL, "
+            "client TEXT NOT NULL DEFAULT 'anonymous', tier TEXT NOT NULL DEFAULT 'free', "
+            "result TEXT, error TEXT, error_status INTEGER, attempts INTEGER NOT NULL DEFAULT 0, "
+            "worker TEXT, lease_until REAL, not_before REAL NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_media ON jobs (media_id, status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, not_before, created_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, fn):
+        conn = self._conn()
+        # IMMEDIATE takes the write lock up front so check-then-write is atomic across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    @staticmethod
+    def _public(row: sqlite3.Row) -> dict:
+        job = {
+            "job_id": row["id"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+            job["error_status"] = row["error_status"]
+        return job
+
+    # --- API side ---
+
+    def enqueue(self, url: str, media_id: str, result: Optional[dict] = None,
+                client: str = "anonymous", tier: str = "free") -> tuple[dict, bool]:
+        """
+        (job, created). A queued/running job for the same reel, or a recent one that found
+        the song, is returned instead of adding a duplicate. Passing `result` records a finished job
+        (cache hit) so clients can use the same polling flow. `client`/`tier` are handed to the
+        worker's fair scheduler.
+        """
+        self._maybe_prune()
+
+        def insert(conn):
+            if result is None:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE media_id = ? AND (status IN ('queued', 'running') "
+                    "OR (status = 'done' AND json_extract(result, '$.success') AND updated_at > ?)) "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (media_id, time.time() - self.retention),
+                ).fetchone()
+                if row is not None:
+                    return self._public(row), False
+
+            now = time.time()
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, media_id, url, client, tier, status, result, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, media_id, url, client, tier, "done" if result is not None else "queued",
+                 json.dumps(result) if result is not None else None, now, now),
+            )
+            return self._public(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()), True
+
+        return self._transaction(insert)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._public(row) if row else None
+
+    # --- Worker side ---
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """Oldest runnable job: queued, or running with an expired lease (its worker died)"""
+        def take(conn):
+            now = time.time()
+            # Jobs whose lease ran out too many times are given up on
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Worker stopped responding', error_status = 500, "
+                "updated_at = ? WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT id, url, media_id, client, tier, attempts FROM jobs WHERE "
+                "(status = 'queued' AND not_before <= ?) OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?",
+                (worker, now + self.lease, now, row["id"]),
+            )
+            return {
+                "job_id": row["id"],
+                "url": row["url"],
+                "media_id": row["media_id"],
+                "client": row["client"],
+                "tier": row["tier"],
+                "attempt": row["attempts"] + 1,
+            }
+
+        return self._transaction(take)
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        """Extend the lease; False if the job was reclaimed by someone else"""
+        cur = self._conn().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time() + self.lease, job_id, worker),
+        )
+        return cur.rowcount == 1
+
+    def complete(self, job_id: str, worker: str, result: dict) -> None:
+        self._conn().execute(
+            "UPDATE jobs SET status = 'done', result = ?, lease_until = NULL, updated_at = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (json.dumps(result), time.time(), job_id, worker),
+        )
+
+    def fail(self, job_id: str, worker: str, error: str, status: int, retry_after: Optional[float] = None) -> None:
+        """Record a failure; with `retry_after` the job goes back to the queue (if attempts remain)"""
+        now = time.time()
+
+        def update(conn):
+            row = conn.execute("SELECT attempts FROM jobs WHERE id = ? AND worker = ?", (job_id, worker)).fetchone()
+            if row is None:
+                return
+            if retry_after is not None and row["attempts"] < self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL, not_before = ?, "
+                    "updated_at = ? WHERE id = ?",
+                    (now + retry_after, now, job_id),
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, error_status = ?, lease_until = NULL, "
+                    "updated_at = ? WHERE id = ?",
+                    (error, status, now, job_id),
+                )
+
+        self._transaction(update)
+
+    # --- Housekeeping ---
+
+    def _maybe_prune(self) -> None:
+        now = time.time()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + 300
+        self._conn().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (now - self.retention,)
+        )
+
+    def has_work(self) -> bool:
+        """Whether any job is queued or running (so workers are needed)"""
+        row = self._conn().execute("SELECT 1 FROM jobs WHERE status IN ('queued', 'running') LIMIT 1").fetchone()
+        return row is not None
+
+    def stats(self) -> dict:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+job_queue = JobQueue(
+    settings.JOB_DB_PATH,
+    lease=settings.JOB_LEASE_SECONDS,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    retention=settings.JOB_RETENTION,
+)
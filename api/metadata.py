@@ -0,0 +1,64 @@
+"""
+Declared-song metadata for Stash API
+Reads the track/artist a reel declares in its extractor metadata, so recognition can skip fingerprinting
+"""
+
+import re
+import unicodedata
+from typing import Optional
+
+# Audio the uploader recorded themselves; never on Spotify under that name
+ORIGINAL_AUDIO = re.compile(
+    r"^(original (sound|audio)|som original|son original|sonido original|suono originale|originalton)\b",
+    re.IGNORECASE,
+)
+# "(feat. X)", "[Remastered 2011]", "- Radio Edit" and similar decorations
+DECORATIONS = re.compile(r"\s*[\(\[][^\)\]]*[\)\]]|\s+-\s+.*$|\s+(feat|ft)\.?\s+.*$", re.IGNORECASE)
+
+# Returned on the response so clients can tell how the song was identified
+METADATA_CONFIDENCE = 0.9
+METADATA_EXACT_CONFIDENCE = 0.95
+
+
+def normalize_title(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "")
+    text = DECORATIONS.sub("", text)
+    return " ".join(re.sub(r"[^\w\s]", " ", text.casefold()).split())
+
+
+def declared_song(info: Optional[dict]) -> Optional[tuple[str, str]]:
+    """
+    (track, artist) when the extractor exposes explicit music fields that look like a real song.
+
+    Only `track` and `artist`/`artists` count: falling back to the post title or uploader (as
+    test_recognition.py does) is a guess, and guesses belong to the fingerprint path.
+    """
+    if not info:
+        return None
+    track = (info.get("track") or "").strip()
+    artist = (info.get("artist") or ", ".join(info.get("artists") or [])).strip()
+    if not track or not artist:
+        return None
+    if ORIGINAL_AUDIO.match(track):
+        return None
+    # The uploader credited as artist is almost always their own "original audio"
+    uploaders = {normalize_title(info.get(field) or "") for field in ("uploader", "uploader_id", "channel")}
+    if normalize_title(artist) in uploaders:
+        return None
+    return track, artist
+
+
+def match_confidence(track: str, artist: str, item: dict) -> Optional[float]:
+    """How well a Spotify track item matches a declared song, or None if it doesn't"""
+    wanted_title = normalize_title(track)
+    wanted_artists = {normalize_title(name) for name in re.split(r",|&| x | and ", artist) if name.strip()}
+    title = normalize_title(item["name"])
+    artists = {normalize_title(a["name"]) for a in item["artists"]}
+
+    if not wanted_title or not (wanted_artists & artists):
+        return None
+    if title == wanted_title:
+        return METADATA_EXACT_CONFIDENCE
+    if wanted_title in title or title in wanted_title:
+        return METADATA_CONFIDENCE
+    return None
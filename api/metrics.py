@@ -0,0 +1,316 @@
+"""
+Metrics for Stash API
+Stage latency histograms and counters in Prometheus text format, plus optional Server-Timing headers
+"""
+
+import atexit
+import contextvars
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from api.config import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Per-request list of (name, seconds) when Server-Timing is on; None otherwise
+_timings: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("stash_timings", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: tuple, values: tuple, **extra) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra.items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self, values: Optional[dict] = None) -> list[str]:
+        """`values` (from snapshot()/merge()) defaults to this process's own"""
+        values = self.snapshot() if values is None else values
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self._samples(values)
+
+    def snapshot(self) -> dict:
+        raise NotImplementedError
+
+    def merge(self, total: dict, key: tuple, value) -> None:
+        total[key] = total.get(key, 0) + value
+
+    def _samples(self, values: dict) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}  # labels → [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+    def merge(self, total: dict, key: tuple, value) -> None:
+        series = total.get(key)
+        total[key] = list(value) if series is None else [a + b for a, b in zip(series, value)]
+
+    def _samples(self, values: dict) -> list[str]:
+        lines = []
+        for key, series in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le=bound)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le='+Inf')} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class CallbackMetric(Metric):
+    """Values read at scrape time from existing stats (no hot-path cost)"""
+
+    def __init__(self, name: str, help: str, labelnames: tuple, callback: Callable[[], dict], type: str = "counter"):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self.callback = callback
+
+    def snapshot(self) -> dict:
+        return self.callback()
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    """
+    All metrics of this process. With share(), every process (web workers, job workers)
+    also writes its samples to <directory>/<pid>.json and /metrics on any of them renders
+    the sum, so counters survive worker recycling instead of resetting per process.
+    Files of exited processes are folded into archive.json; their gauges are dropped.
+    """
+
+    ARCHIVE = "archive.json"
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+        self.directory: Optional[str] = None
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def share(self, directory: str, interval: float) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        atexit.register(self.flush)
+
+        def flush_loop():
+            while True:
+                time.sleep(interval)
+                self.flush()
+
+        threading.Thread(target=flush_loop, daemon=True, name="stash-metrics").start()
+
+    def _own_samples(self) -> dict:
+        samples = {}
+        for metric in self.metrics:
+            try:
+                samples[metric.name] = metric.snapshot()
+            except Exception as e:
+                print(f"⚠️ Metric {metric.name} failed: {e}")
+        return samples
+
+    def _write(self, path: str, samples: dict) -> None:
+        data = {name: [[list(key), value] for key, value in values.items()] for name, values in samples.items()}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def _read(self, path: str) -> dict:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {name: {tuple(key): value for key, value in pairs} for name, pairs in data.items()}
+
+    @classmethod
+    def clear(cls, directory: str) -> None:
+        """Delete the files share() writes in `directory` (and nothing else)"""
+        patterns = ("[0-9]*.json", cls.ARCHIVE, "*.json.*.tmp", ".lock")
+        for pattern in patterns:
+            for path in glob.glob(os.path.join(directory, pattern)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def flush(self) -> None:
+        if self.directory is not None:
+            self._write(os.path.join(self.directory, f"{os.getpid()}.json"), self._own_samples())
+
+    def _merge_into(self, totals: dict, samples: dict, gauges: bool) -> None:
+        for metric in self.metrics:
+            if metric.type == "gauge" and not gauges:
+                continue
+            total = totals.setdefault(metric.name, {})
+            for key, value in samples.get(metric.name, {}).items():
+                metric.merge(total, key, value)
+
+    def _merged(self) -> dict:
+        self.flush()
+        archive_path = os.path.join(self.directory, self.ARCHIVE)
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = self._read(archive_path)
+            totals = {}
+            archived = False
+            for path in glob.glob(os.path.join(self.directory, "[0-9]*.json")):
+                samples = self._read(path)
+                if process_alive(int(os.path.basename(path)[:-5])):
+                    self._merge_into(totals, samples, gauges=True)
+                else:
+                    self._merge_into(archive, samples, gauges=False)
+                    os.remove(path)
+                    archived = True
+            if archived:
+                self._write(archive_path, archive)
+        self._merge_into(totals, archive, gauges=False)
+        return totals
+
+    def render(self) -> str:
+        merged = self._merged() if self.directory is not None else {}
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render(merged.get(metric.name, {}) if self.directory is not None else None))
+            except Exception as e:
+                print(f"⚠️ Metric {metric.name} failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.add(Histogram(
+    "stash_stage_duration_seconds", "Time spent in each pipeline stage and operation", ("stage", "op"),
+))
+stage_errors = registry.add(Counter(
+    "stash_stage_errors_total", "Pipeline stage operations that raised", ("stage", "op"),
+))
+upstream_errors = registry.add(Counter(
+    "stash_upstream_errors_total", "Failed calls to upstream services", ("upstream",),
+))
+rate_limited = registry.add(Counter(
+    "stash_rate_limited_total", "Requests rejected by the rate limiter", ("path",),
+))
+queue_wait = registry.add(Histogram(
+    "stash_queue_wait_seconds", "Time recognitions waited for a pipeline slot", ("tier",),
+))
+
+# Multi-worker deployments: aggregate every process's samples through METRICS_DIR
+if settings.METRICS_DIR:
+    registry.share(settings.METRICS_DIR, settings.METRICS_FLUSH_INTERVAL)
+
+
+def observe(stage: str, op: str, seconds: float) -> None:
+    stage_seconds.observe(seconds, stage=stage, op=op)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((f"{stage}_{op}", seconds))
+
+
+@contextmanager
+def timed(stage: str, op: str):
+    """Record how long the block takes; usable from threads and coroutines alike"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, op, time.perf_counter() - started)
+
+
+class ServerTimingMiddleware:
+    """Adds a Server-Timing header listing the stages a request went through"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = []
+        token = _timings.set(timings)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings]
+                entries.append(f"total;dur={(time.perf_counter() - started) * 1000:.1f}")
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", ", ".join(entries).encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
@@ -0,0 +1,264 @@
+"""
+Rate limiting for Stash API
+Approximate sliding-window counters with O(1) state per client and pluggable storage
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from api.config import settings
+from api.metrics import rate_limited
+
+
+def client_key(scope_headers: dict, client: Optional[tuple]) -> str:
+    """Real client IP behind proxies/load balancers, falling back to the socket peer"""
+    forwarded = scope_headers.get("x-forwarded-for", "")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return client[0] if client else "unknown"
+
+
+def sliding_count(previous: int, current: int, window_start: float, window: float, now: float) -> float:
+    """
+    Estimate requests in the trailing window from two fixed-window counters.
+
+    The previous window's count is weighted by how much of it still overlaps the
+    trailing window, which keeps memory at two integers per key.
+    """
+    overlap = max(0.0, 1.0 - (now - window_start) / window)
+    return previous * overlap + current
+
+
+class RateLimitBackend:
+    """Storage for (window_start, previous, current) counters keyed by client"""
+
+    blocking = False
+
+    def hit(self, key: str, limit: int, window: float) -> tuple[bool, float]:
+        """Record one request if allowed. Returns (allowed, retry_after_seconds)."""
+        raise NotImplementedError
+
+    def evict_idle(self, window: float) -> int:
+        """Drop keys with no activity in the last two windows. Returns how many were removed."""
+        return 0
+
+
+def _advance(state: Optional[tuple], window: float, now: float) -> tuple[float, int, int]:
+    """Roll a (window_start, previous, current) triple forward to the window containing `now`"""
+    window_start = now - (now % window)
+    if state is None:
+        return window_start, 0, 0
+    start, previous, current = state
+    if start == window_start:
+        return start, previous, current
+    if start == window_start - window:
+        return window_start, current, 0
+    return window_start, 0, 0
+
+
+def _decide(state: tuple, limit: int, window: float, now: float) -> tuple[bool, float, tuple]:
+    window_start, previous, current = state
+    if sliding_count(previous, current, window_start, window, now) + 1 > limit:
+        # Retry once enough of the previous window has slid out (or the next window starts)
+        if previous:
+            needed = sliding_count(previous, current, window_start, window, now) + 1 - limit
+            retry_after = min(window_start + window - now, needed / previous * window)
+        else:
+            retry_after = window_start + window - now
+        return False, max(1.0, retry_after), state
+    return True, 0.0, (window_start, previous, current + 1)
+
+
+class MemoryBackend(RateLimitBackend):
+    """Per-process counters; fine for a single worker"""
+
+    def __init__(self):
+        self._state: dict[str, tuple[float, int, int]] = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        with self._lock:
+            state = _advance(self._state.get(key), window, now)
+            allowed, retry_after, state = _decide(state, limit, window, now)
+            self._state[key] = state
+        return allowed, retry_after
+
+    def evict_idle(self, window):
+        cutoff = time.time() - 2 * window
+        with self._lock:
+            idle = [key for key, (start, _, _) in self._state.items() if start < cutoff]
+            for key in idle:
+                del self._state[key]
+        return len(idle)
+
+    def __len__(self):
+        return len(self._state)
+
+
+class SQLiteBackend(RateLimitBackend):
+    """Counters in a SQLite file shared by every worker process on the host"""
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit "
+            "(key TEXT PRIMARY KEY, window_start REAL NOT NULL, previous INTEGER NOT NULL, current INTEGER NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        conn = self._conn()
+        # IMMEDIATE takes the write lock up front so read-modify-write is atomic across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT window_start, previous, current FROM rate_limit WHERE key = ?", (key,)
+            ).fetchone()
+            state = _advance(tuple(row) if row else None, window, now)
+            allowed, retry_after, state = _decide(state, limit, window, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limit (key, window_start, previous, current) VALUES (?, ?, ?, ?)",
+                (key, *state),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+    def evict_idle(self, window):
+        cur = self._conn().execute("DELETE FROM rate_limit WHERE window_start < ?", (time.time() - 2 * window,))
+        return cur.rowcount
+
+
+class RedisBackend(RateLimitBackend):
+    """
+    Counters in any Redis-protocol server (Redis, Valkey, KeyDB or a local stand-in).
+
+    Each fixed window is its own key with a TTL of two windows, so idle clients are
+    evicted by the server and no sweep is needed.
+    """
+
+    blocking = True
+
+    def __init__(self, url: str):
+        import redis  # Optional dependency, only needed for this backend
+
+        self._redis = redis.Redis.from_url(url)
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        window_start = now - (now % window)
+        current_key = f"stash:rl:{key}:{int(window_start)}"
+        previous_key = f"stash:rl:{key}:{int(window_start - window)}"
+
+        # Count first, then undo if over the limit, so concurrent workers can't both slip through
+        pipe = self._redis.pipeline()
+        pipe.incr(current_key)
+        pipe.expire(current_key, int(2 * window))
+        pipe.get(previous_key)
+        current, _, previous = pipe.execute()
+
+        state = (window_start, int(previous or 0), int(current) - 1)
+        allowed, retry_after, _ = _decide(state, limit, window, now)
+        if not allowed:
+            self._redis.decr(current_key)
+        return allowed, retry_after
+
+
+async def hit_async(backend: RateLimitBackend, key: str, limit: int, window: float) -> tuple[bool, float]:
+    """Record a hit without blocking the event loop on shared backends"""
+    if backend.blocking:
+        return await asyncio.to_thread(backend.hit, key, limit, window)
+    return backend.hit(key, limit, window)
+
+
+def create_backend() -> RateLimitBackend:
+    backend = settings.RATE_LIMIT_BACKEND
+    if backend == "sqlite":
+        return SQLiteBackend(settings.RATE_LIMIT_DB_PATH)
+    if backend == "redis":
+        return RedisBackend(settings.REDIS_URL)
+    return MemoryBackend()
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware that enforces RATE_LIMIT_PER_DAY on the pipeline endpoints.
+
+    Runs before the request body is parsed, so rejected clients never reach the
+    cache, download or Shazam stages.
+    """
+
+    def __init__(self, app, backend: RateLimitBackend, paths: set[str], limit: int, window: float):
+        self.app = app
+        self.backend = backend
+        self.paths = paths
+        self.limit = limit
+        self.window = window
+        self.rejected = 0
+        self._next_eviction = time.time() + settings.RATE_LIMIT_EVICT_INTERVAL
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        key = client_key(headers, scope.get("client"))
+
+        allowed, retry_after = await hit_async(self.backend, key, self.limit, self.window)
+
+        await self._maybe_evict()
+
+        if not allowed:
+            self.rejected += 1
+            rate_limited.inc(path=scope["path"])
+            if settings.ENABLE_DEBUG_LOGS:
+                print(f"🚫 Rate limited: {key}")
+            body = json.dumps({
+                "detail": f"Daily limit reached ({self.limit} reels/day). Upgrade to Pro for unlimited access!"
+            }).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(int(retry_after)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        await self.app(scope, receive, send)
+
+    async def _maybe_evict(self) -> None:
+        now = time.time()
+        if now < self._next_eviction:
+            return
+        self._next_eviction = now + settings.RATE_LIMIT_EVICT_INTERVAL
+        try:
+            if self.backend.blocking:
+                evicted = await asyncio.to_thread(self.backend.evict_idle, self.window)
+            else:
+                evicted = self.backend.evict_idle(self.window)
+            if settings.ENABLE_DEBUG_LOGS and evicted:
+                print(f"🧹 Evicted {evicted} idle rate-limit keys")
+        except Exception as e:
+            print(f"⚠️ Rate-limit eviction failed: {e}")
@@ -0,0 +1,175 @@
+"""
+Fair scheduling for the recognition pipeline
+Shares download/fingerprint capacity between clients so one heavy submitter can't starve the rest
+"""
+
+import asyncio
+import hashlib
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from api.config import settings
+from api.executor import StageOverloaded
+from api.metrics import queue_wait
+from api.ratelimit import client_key
+
+
+def client_identity(headers, client: Optional[tuple]) -> tuple[str, str]:
+    """(client key, tier): a known X-Stash-Key is its own client on the pro tier, anyone else is their IP"""
+    api_key = headers.get("x-stash-key", "")
+    if api_key and api_key in settings.PRO_API_KEYS:
+        return f"key:{hashlib.sha256(api_key.encode()).hexdigest()[:16]}", "pro"
+    return client_key(headers, client), "free"
+
+
+class _Waiter:
+    __slots__ = ("client", "tier", "start", "queued_at", "future")
+
+    def __init__(self, client: str, tier: str, start: float, future: asyncio.Future):
+        self.client = client
+        self.tier = tier
+        self.start = start
+        self.queued_at = time.monotonic()
+        self.future = future
+
+
+class FairScheduler:
+    """
+    Start-time fair queueing over clients, with a weight per tier.
+
+    Each request is tagged start = max(virtual clock, the client's previous finish) and
+    finish = start + 1/weight; free slots go to the waiting request with the lowest start
+    tag. A client with a long backlog therefore only advances its own tags, and a newcomer
+    is served next. Pro requests advance their client's clock `weight` times slower, so
+    the pro lane gets the larger share without shutting free users out.
+
+    Clients are also capped at `per_client` running recognitions and `client_queue`
+    waiting ones; past that (or past `max_queue` overall) callers get StageOverloaded.
+    """
+
+    def __init__(self, name: str, slots: int, max_queue: int, client_queue: int,
+                 per_client: dict[str, int], weights: dict[str, float]):
+        self.name = name
+        self.slots = max(1, slots)
+        self.max_queue = max_queue
+        self.client_queue = client_queue
+        self.per_client = per_client
+        self.weights = weights
+        self.running = 0
+        self.rejected = 0
+        self._virtual = 0.0
+        self._finish: dict[str, float] = {}
+        self._inflight: dict[str, int] = {}
+        self._queued: dict[str, int] = {}
+        self._waiting: list[_Waiter] = []
+
+    def _tag(self, client: str, tier: str) -> float:
+        start = max(self._virtual, self._finish.get(client, 0.0))
+        self._finish[client] = start + 1 / self.weights.get(tier, 1)
+        return start
+
+    def _runnable(self, client: str, tier: str) -> bool:
+        return self._inflight.get(client, 0) < self.per_client.get(tier, 1)
+
+    def _start(self, client: str, start: float) -> None:
+        self.running += 1
+        self._inflight[client] = self._inflight.get(client, 0) + 1
+        self._virtual = max(self._virtual, start)
+
+    def _release(self, client: str) -> None:
+        self.running -= 1
+        self._inflight[client] -= 1
+        if not self._inflight[client]:
+            del self._inflight[client]
+        self._dispatch()
+        self._forget_if_idle(client)
+
+    def _forget_if_idle(self, client: str) -> None:
+        # A client with nothing running or queued starts again from the virtual clock,
+        # which keeps state bounded by active clients rather than every IP ever seen
+        if client not in self._inflight and client not in self._queued:
+            self._finish.pop(client, None)
+
+    def _dispatch(self) -> None:
+        while self.running < self.slots:
+            candidates = [w for w in self._waiting if self._runnable(w.client, w.tier)]
+            if not candidates:
+                return
+            waiter = min(candidates, key=lambda w: w.start)
+            self._waiting.remove(waiter)
+            self._dequeued(waiter)
+            if waiter.future.done():
+                # Its caller was cancelled in this same tick; _acquire cleans up after it
+                continue
+            self._start(waiter.client, waiter.start)
+            waiter.future.set_result(None)
+
+    def _dequeued(self, waiter: _Waiter) -> None:
+        self._queued[waiter.client] -= 1
+        if not self._queued[waiter.client]:
+            del self._queued[waiter.client]
+        queue_wait.observe(time.monotonic() - waiter.queued_at, tier=waiter.tier)
+
+    def _can_start_now(self, client: str, tier: str) -> bool:
+        # Waiters held back only by their own client's cap don't keep anyone else out of a free slot
+        if self.running >= self.slots or not self._runnable(client, tier):
+            return False
+        start = max(self._virtual, self._finish.get(client, 0.0))
+        return not any(w.start < start and self._runnable(w.client, w.tier) for w in self._waiting)
+
+    async def _acquire(self, client: str, tier: str) -> None:
+        if self._can_start_now(client, tier):
+            self._start(client, self._tag(client, tier))
+            queue_wait.observe(0, tier=tier)
+            return
+
+        if len(self._waiting) >= self.max_queue or self._queued.get(client, 0) >= self.client_queue:
+            self.rejected += 1
+            raise StageOverloaded(self.name, settings.OVERLOAD_RETRY_AFTER)
+
+        waiter = _Waiter(client, tier, self._tag(client, tier), asyncio.get_running_loop().create_future())
+        self._waiting.append(waiter)
+        self._queued[client] = self._queued.get(client, 0) + 1
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted a slot in the same tick the caller gave up: hand it on
+                self._release(client)
+            else:
+                # Still queued, unless _dispatch already dropped it
+                if waiter in self._waiting:
+                    self._waiting.remove(waiter)
+                    self._dequeued(waiter)
+                self._forget_if_idle(client)
+            raise
+
+    @asynccontextmanager
+    async def slot(self, client: str, tier: str = "free"):
+        """Hold one pipeline slot for `client` for the duration of the block"""
+        await self._acquire(client, tier)
+        try:
+            yield
+        finally:
+            self._release(client)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "slots": self.slots,
+            "waiting": len(self._waiting),
+            "clients": len(self._inflight) + len(set(self._queued) - set(self._inflight)),
+            "rejected": self.rejected,
+        }
+
+
+recognition_scheduler = FairScheduler(
+    "scheduler",
+    slots=settings.SCHEDULER_SLOTS,
+    max_queue=settings.SCHEDULER_QUEUE_SIZE,
+    client_queue=settings.SCHEDULER_CLIENT_QUEUE,
+    per_client={"free": settings.SCHEDULER_CLIENT_INFLIGHT, "pro": settings.SCHEDULER_PRO_INFLIGHT},
+    weights={"free": 1, "pro": settings.SCHEDULER_PRO_WEIGHT},
+)
@@ -0,0 +1,49 @@
+"""
+Request coalescing for Stash API
+Concurrent calls for the same key share one in-flight execution and its result or error
+"""
+
+import asyncio
+
+from api.config import settings
+from api.executor import StageOverloaded
+
+
+class SingleFlight:
+    """
+    In-flight call table keyed by e.g. canonical media ID.
+
+    The first caller for a key starts the work as its own task; every concurrent caller
+    awaits that task through `asyncio.shield`, so a client disconnecting cancels only
+    its own wait and never the shared work.
+    """
+
+    def __init__(self, name: str, max_inflight: int):
+        self.name = name
+        self.max_inflight = max_inflight
+        self.coalesced = 0
+        self._calls: dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn, *args, **kwargs):
+        task = self._calls.get(key)
+        if task is None:
+            if len(self._calls) >= self.max_inflight:
+                raise StageOverloaded(self.name, settings.OVERLOAD_RETRY_AFTER)
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+            if settings.ENABLE_DEBUG_LOGS:
+                print(f"🔗 Joining in-flight {self.name}: {key}")
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the error as retrieved in case every waiter has already gone away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"inflight": len(self._calls), "max_inflight": self.max_inflight, "coalesced": self.coalesced}
@@ -0,0 +1,125 @@
+"""
+Spotify clients for Stash API (spotipy on one shared requests transport)
+Imported on first use through api.clients, so spotipy and requests stay out of process start-up
+"""
+
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+import spotipy
+from requests.adapters import HTTPAdapter
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials
+from urllib3.util.retry import Retry
+
+from api.clients import RETRY_STATUSES
+from api.config import settings
+from api.metrics import observe, upstream_errors
+
+
+class CappedRetry(Retry):
+    """urllib3 Retry with full jitter that never sleeps longer than HTTP_MAX_RETRY_AFTER"""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, settings.HTTP_MAX_RETRY_AFTER)
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        # POST isn't idempotent (a 5xx may come after the playlist was created or the track added);
+        # only a 429 is a guaranteed no-op. Connection errors are retried for every method.
+        if method.upper() == "POST":
+            return status_code == 429
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+_spotify_session: Optional[requests.Session] = None
+_spotify_lock = threading.Lock()
+
+
+def get_spotify_session() -> requests.Session:
+    """One keep-alive connection pool for every Spotify call, app or user token"""
+    global _spotify_session
+    if _spotify_session is None:
+        with _spotify_lock:
+            if _spotify_session is None:
+                session = requests.Session()
+                retry = CappedRetry(
+                    total=settings.HTTP_RETRIES,
+                    connect=settings.HTTP_RETRIES,
+                    read=False,
+                    status=settings.HTTP_RETRIES,
+                    allowed_methods=frozenset(["GET", "PUT", "DELETE"]),
+                    status_forcelist=RETRY_STATUSES,
+                    backoff_factor=settings.HTTP_BACKOFF_BASE,
+                    backoff_max=settings.HTTP_BACKOFF_MAX,
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=settings.HTTP_POOL_SIZE,
+                    max_retries=retry,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _spotify_session = session
+    return _spotify_session
+
+
+class SharedSessionSpotify(spotipy.Spotify):
+    """spotipy client that borrows the shared session instead of owning (and closing) it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prefix = settings.SPOTIFY_API_BASE
+
+    def __del__(self):
+        pass
+
+    def _internal_call(self, method, url, payload, params):
+        # Every Web API request goes through here: time it and count failures
+        started = time.perf_counter()
+        try:
+            return super()._internal_call(method, url, payload, params)
+        except Exception:
+            upstream_errors.inc(upstream="spotify")
+            raise
+        finally:
+            observe("spotify_http", method.lower(), time.perf_counter() - started)
+
+
+def _spotify_kwargs() -> dict:
+    return {
+        "requests_session": get_spotify_session(),
+        "requests_timeout": (settings.SPOTIFY_CONNECT_TIMEOUT, settings.SPOTIFY_READ_TIMEOUT),
+        # Retries are handled by the shared adapter
+        "retries": 0,
+        "status_retries": 0,
+    }
+
+
+def app_spotify() -> spotipy.Spotify:
+    """Client-credentials Spotify client for catalog search"""
+    auth_manager = SpotifyClientCredentials(
+        client_id=settings.SPOTIFY_CLIENT_ID,
+        client_secret=settings.SPOTIFY_CLIENT_SECRET,
+        requests_session=get_spotify_session(),
+        requests_timeout=(settings.SPOTIFY_CONNECT_TIMEOUT, settings.SPOTIFY_READ_TIMEOUT),
+        # The app token lives as long as the process; spotipy's default would write it to ./.cache
+        cache_handler=MemoryCacheHandler(),
+    )
+    auth_manager.OAUTH_TOKEN_URL = settings.SPOTIFY_TOKEN_URL
+    return SharedSessionSpotify(auth_manager=auth_manager, **_spotify_kwargs())
+
+
+def user_spotify(token: str) -> spotipy.Spotify:
+    """Per-request Spotify client for a user's OAuth token, on the shared transport"""
+    return SharedSessionSpotify(auth=token, **_spotify_kwargs())
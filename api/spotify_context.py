@@ -0,0 +1,115 @@
+"""
+Per-user Spotify context cache for /save_track
+Remembers each token's user ID and a fully paginated playlist-name → ID index
+"""
+
+import hashlib
+import threading
+from typing import Optional
+
+from api.cache import TTLCache
+from api.config import settings
+
+
+class UserContext:
+    """A user's ID plus an index of the playlists they own"""
+
+    def __init__(self, user_id: str, playlists: dict[str, tuple[str, str]]):
+        self.user_id = user_id
+        self._by_name = playlists  # lowercased name → (id, display name)
+        self._names_by_id = {pid: name for pid, name in playlists.values()}
+        self.lock = threading.Lock()
+
+    def find(self, name: str) -> Optional[str]:
+        entry = self._by_name.get(name.lower())
+        return entry[0] if entry else None
+
+    def name_of(self, playlist_id: str) -> Optional[str]:
+        return self._names_by_id.get(playlist_id)
+
+    def add(self, playlist_id: str, name: str) -> None:
+        self._by_name[name.lower()] = (playlist_id, name)
+        self._names_by_id[playlist_id] = name
+
+    def forget(self, playlist_id: str) -> None:
+        name = self._names_by_id.pop(playlist_id, None)
+        if name:
+            self._by_name.pop(name.lower(), None)
+
+
+def _token_key(token: str) -> str:
+    # Never keep raw OAuth tokens around as cache keys
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class SpotifyContextCache:
+    """token → user ID and user ID → UserContext, both with a TTL"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._users = TTLCache(maxsize, ttl)
+        self._contexts = TTLCache(maxsize, ttl)
+        self._loading: dict[str, threading.Lock] = {}
+        self._loading_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_sp, token: str) -> UserContext:
+        token_key = _token_key(token)
+        user_id = self._users.get(token_key)
+        if user_id is None:
+            user_id = user_sp.current_user()["id"]
+            self._users.set(token_key, user_id)
+
+        context = self._contexts.get(user_id)
+        if context is not None:
+            self.hits += 1
+            return context
+
+        # One loader per user so concurrent saves don't all paginate the same playlists
+        with self._loading_lock:
+            lock = self._loading.setdefault(user_id, threading.Lock())
+        with lock:
+            context = self._contexts.get(user_id)
+            if context is None:
+                self.misses += 1
+                context = UserContext(user_id, self._load_playlists(user_sp, user_id))
+                self._contexts.set(user_id, context)
+        with self._loading_lock:
+            self._loading.pop(user_id, None)
+        return context
+
+    def peek(self, token: str) -> Optional[UserContext]:
+        """The cached context for `token`, or None; never calls Spotify"""
+        user_id = self._users.get(_token_key(token))
+        return self._contexts.get(user_id) if user_id is not None else None
+
+    @staticmethod
+    def _load_playlists(user_sp, user_id: str) -> dict[str, tuple[str, str]]:
+        playlists = {}
+        page = user_sp.current_user_playlists(limit=50)
+        while page:
+            for p in page["items"]:
+                # Only playlists we can add to; first one wins on duplicate names
+                if p and p.get("owner", {}).get("id") == user_id:
+                    playlists.setdefault(p["name"].lower(), (p["id"], p["name"]))
+            page = user_sp.next(page) if page.get("next") else None
+        return playlists
+
+    def find_or_create(self, user_sp, context: UserContext, name: str) -> tuple[str, bool]:
+        """Playlist ID for `name`, creating it once even under concurrent saves"""
+        with context.lock:
+            playlist_id = context.find(name)
+            if playlist_id:
+                return playlist_id, False
+            new_playlist = user_sp.user_playlist_create(context.user_id, name, public=False)
+            context.add(new_playlist["id"], name)
+            return new_playlist["id"], True
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "users": len(self._contexts)}
+
+
+spotify_contexts = SpotifyContextCache(
+    maxsize=settings.SPOTIFY_CONTEXT_CACHE_SIZE,
+    ttl=settings.SPOTIFY_CONTEXT_TTL,
+)
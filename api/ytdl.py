@@ -0,0 +1,140 @@
+"""
+Pooled yt-dlp instances for Stash API
+Builds each YoutubeDL once per mode and cookie account, then lends it out per download
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from api.audio import has_ffmpeg
+from api.config import settings
+
+BASE_OPTIONS = {
+    'quiet': False,
+    'no_warnings': False,
+    'nocheckcertificate': True,
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 14_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Sec-Fetch-Mode': 'navigate',
+    },
+}
+
+# Per-request params set on checkout and cleared on return
+REQUEST_PARAMS = ('paths', 'download_ranges')
+
+
+def mode_options(mode: str) -> dict:
+    """
+    probe: resolve the stream URL only (download=False)
+    clip:  fetch only the fingerprint windows as small mono low-rate WAVs
+    mp3:   whole file, transcoded (ffmpeg but clip mode off)
+    raw:   whole file as-is (no ffmpeg)
+    """
+    if mode == 'probe':
+        return {'format': 'bestaudio/best'}
+    if mode == 'clip':
+        return {
+            'format': 'bestaudio/best',
+            'outtmpl': 'audio_%(section_start)d.%(ext)s',
+            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'wav'}],
+            'postprocessor_args': {'extractaudio': ['-ac', '1', '-ar', str(settings.CLIP_SAMPLE_RATE)]},
+        }
+    if mode == 'mp3':
+        return {
+            'format': 'bestaudio/best',
+            'outtmpl': 'audio',
+            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3'}],
+        }
+    return {'format': 'bestaudio', 'outtmpl': 'audio.%(ext)s'}
+
+
+def download_mode() -> str:
+    """Disk download mode for this host"""
+    if not has_ffmpeg():
+        return 'raw'
+    return 'clip' if settings.CLIP_ENABLED else 'mp3'
+
+
+class YoutubeDLPool:
+    """
+    Idle YoutubeDL instances keyed by (mode, cookie file). Each checkout gets exclusive
+    use of one instance; it is reset on return and closed after YTDL_MAX_USES downloads
+    so per-instance state (caches, cookie jars, open connections) can't grow forever.
+    """
+
+    def __init__(self, max_idle: int, max_uses: int):
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.created = 0
+        self.reused = 0
+        self.recycled = 0
+        self._idle: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def _build(self, mode: str, cookie_file: Optional[str]):
+        import yt_dlp  # Deferred: the extractor registry is slow to import and only needed per download
+
+        options = {**BASE_OPTIONS, **mode_options(mode)}
+        if cookie_file:
+            options['cookiefile'] = cookie_file
+        ydl = yt_dlp.YoutubeDL(options)
+        ydl._stash_uses = 0
+        self.created += 1
+        return ydl
+
+    @contextmanager
+    def checkout(self, mode: str, cookie_file: Optional[str] = None, **params):
+        """Lend an instance for one request; `params` (paths, download_ranges) apply to this use only"""
+        key = (mode, cookie_file)
+        with self._lock:
+            idle = self._idle.get(key)
+            ydl = idle.pop() if idle else None
+        if ydl is None:
+            ydl = self._build(mode, cookie_file)
+        else:
+            self.reused += 1
+
+        ydl.params.update(params)
+        try:
+            yield ydl
+        finally:
+            self._checkin(key, ydl)
+
+    def _checkin(self, key: tuple, ydl) -> None:
+        for param in REQUEST_PARAMS:
+            ydl.params.pop(param, None)
+        ydl._download_retcode = 0
+        if key[1] is None:
+            # Anonymous instances must not carry session cookies into the next request
+            ydl.cookiejar.clear()
+        ydl._stash_uses += 1
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if ydl._stash_uses < self.max_uses and len(idle) < self.max_idle:
+                idle.append(ydl)
+                return
+        self.recycled += 1
+        ydl.close()
+
+    def warm(self, cookie_files: tuple = ()) -> None:
+        """Pre-build one instance per mode this host will use, cookieless and per account"""
+        modes = ['probe', download_mode()] if has_ffmpeg() and settings.CLIP_ENABLED else [download_mode()]
+        for cookie_file in (None, *cookie_files):
+            for mode in modes:
+                with self.checkout(mode, cookie_file):
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = sum(len(instances) for instances in self._idle.values())
+        return {"created": self.created, "reused": self.reused, "recycled": self.recycled, "idle": idle}
+
+
+ydl_pool = YoutubeDLPool(
+    max_idle=settings.YTDL_POOL_SIZE,
+    max_uses=settings.YTDL_MAX_USES,
+)
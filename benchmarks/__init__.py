@@ -0,0 +1 @@
+# Local load-test and benchmark tooling
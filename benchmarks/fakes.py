@@ -0,0 +1,446 @@
+"""
+Local stand-ins for Stash's upstream APIs
+Threaded HTTP servers with configurable latency and error injection (plus a tiny Redis), for tests and benchmarks
+"""
+
+import hashlib
+import io
+import itertools
+import json
+import math
+import random
+import re
+import socketserver
+import struct
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+GENRES = ["Pop", "House", "Techno", "Rock", "HipHop", "Ambient", "RnB", "Indie"]
+NOTES = [220, 247, 262, 294, 330, 349, 392, 440, 494, 523, 587, 659, 698, 784, 880, 988]
+
+
+def fake_genre(title: str, artist: str) -> str:
+    """Deterministic genre so repeated runs give identical answers"""
+    digest = hashlib.md5(f"{artist}|{title}".lower().encode()).digest()
+    return GENRES[digest[0] % len(GENRES)]
+
+
+def fake_track(index: int) -> dict:
+    """Catalog entry shared by the fake Shazam and fake Spotify"""
+    title, artist = f"Fixture Song {index:02d}", f"Fixture Artist {index % 7}"
+    return {
+        "index": index,
+        "title": title,
+        "artist": artist,
+        "id": hashlib.md5(f"track-{index}".encode()).hexdigest()[:22],
+        "isrc": f"QZFX{index:08d}",
+        "popularity": 40 + index % 60,
+    }
+
+
+def fixture_audio(seed: int, seconds: float = 20, sample_rate: int = 16000) -> bytes:
+    """A short synthetic "song" (two-voice note sequence) as mono 16-bit WAV bytes"""
+    rnd = random.Random(seed)
+    notes = [rnd.choice(NOTES) for _ in range(int(seconds * 4) + 4)]
+    frames = bytearray()
+    for n in range(int(seconds * sample_rate)):
+        step = n * 4 // sample_rate
+        value = 0.4 * math.sin(2 * math.pi * notes[step] * n / sample_rate)
+        value += 0.2 * math.sin(2 * math.pi * notes[step + 3] * 1.5 * n / sample_rate)
+        frames += struct.pack("<h", int(value * 20000))
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+class FakeUpstream:
+    """
+    Base fake server. Subclasses implement `handle()` and return (status, headers, body).
+
+    `latency` (seconds, or a (min, max) range) is added to every response; a random
+    `error_rate` fraction of requests gets `error_status` with a Retry-After header.
+    """
+
+    def __init__(self, latency=0.0, error_rate: float = 0.0, error_status: int = 503):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self._server = None
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self):
+                length = int(self.headers.get("content-length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, headers, payload = fake._respond(self.command, self.path, self.headers, body)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("content-length", str(len(payload)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _serve
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _respond(self, method, path, headers, body):
+        with self._lock:
+            self.requests += 1
+
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status, {"retry-after": "0"}, b""
+
+        parts = urlsplit(path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        return self.handle(method, parts.path, query, headers, body)
+
+    def handle(self, method, path, query, headers, body):
+        raise NotImplementedError
+
+    @staticmethod
+    def json_response(data, status: int = 200):
+        return status, {"content-type": "application/json"}, json.dumps(data).encode()
+
+
+class FakeGemini(FakeUpstream):
+    """generateContent endpoint answering single-song, batched-JSON and vibe prompts"""
+
+    def __init__(self, *args, drop_ids=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drop_ids = set(drop_ids)  # Omit these ids from batch answers
+        self.prompts = []
+
+    def handle(self, method, path, query, headers, body):
+        if method != "POST" or not path.endswith(":generateContent"):
+            return self.json_response({"error": {"message": "not found"}}, 404)
+
+        prompt = json.loads(body)["contents"][0]["parts"][0]["text"]
+        with self._lock:
+            self.prompts.append(prompt)
+
+        if "Songs:\n" in prompt:
+            songs = json.loads(prompt.split("Songs:\n", 1)[1])
+            answer = json.dumps([
+                {"id": song["id"], "genre": fake_genre(song["title"], song["artist"])}
+                for song in songs if song["id"] not in self.drop_ids
+            ])
+        elif "genre of the song" in prompt:
+            answer = "Pop."
+        else:
+            answer = "Sunlit indie pop for long drives."
+
+        return self.json_response({"candidates": [{"content": {"parts": [{"text": answer}]}}]})
+
+
+class FakeMedia(FakeUpstream):
+    """
+    Direct-link media server for yt-dlp's generic extractor.
+    `/reel/<song>/<anything>.wav` serves fixture song <song>; any suffix makes a unique reel URL.
+    """
+
+    def __init__(self, *args, songs: int = 8, seconds: float = 20, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.songs = [fixture_audio(seed, seconds) for seed in range(songs)]
+
+    def reel_url(self, song: int, reel: str) -> str:
+        return f"{self.base_url}/reel/{song % len(self.songs)}/{reel}.wav"
+
+    def handle(self, method, path, query, headers, body):
+        match = re.fullmatch(r"/reel/(\d+)/[\w.-]+\.wav", path)
+        if not match or int(match.group(1)) >= len(self.songs):
+            return 404, {"content-type": "text/plain"}, b"not found"
+        audio = self.songs[int(match.group(1))]
+
+        # Honour single byte ranges so ffmpeg input seeking works against the fake
+        status, extra = 200, {"accept-ranges": "bytes"}
+        range_header = headers.get("range") or ""
+        ranged = re.fullmatch(r"bytes=(\d+)-(\d*)", range_header.strip())
+        if ranged:
+            start = int(ranged.group(1))
+            end = int(ranged.group(2)) if ranged.group(2) else len(audio) - 1
+            extra["content-range"] = f"bytes {start}-{end}/{len(audio)}"
+            audio, status = audio[start:end + 1], 206
+        return status, {"content-type": "audio/wav", **extra}, audio
+
+
+class FakeShazam(FakeUpstream):
+    """Tag endpoint: every signature maps to a catalog track (same signature → same track)"""
+
+    def __init__(self, *args, catalog_size: int = 8, no_match_rate: float = 0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.catalog_size = catalog_size
+        self.no_match_rate = no_match_rate
+
+    def handle(self, method, path, query, headers, body):
+        if method != "POST" or "/tag/" not in path:
+            return self.json_response({"error": "not found"}, 404)
+        if self.no_match_rate and random.random() < self.no_match_rate:
+            return self.json_response({"matches": [], "tagid": "none"})
+
+        uri = json.loads(body)["signature"]["uri"]
+        track = fake_track(int(hashlib.md5(uri.encode()).hexdigest(), 16) % self.catalog_size)
+        # Half the catalog carries a direct Spotify link, the rest only an ISRC
+        actions = [{"uri": f"spotify:track:{track['id']}"}] if track["index"] % 2 == 0 else []
+        return self.json_response({
+            "matches": [{"id": str(track["index"]), "offset": 1.0}],
+            "track": {
+                "key": str(100000 + track["index"]),
+                "title": track["title"],
+                "subtitle": track["artist"],
+                "isrc": track["isrc"],
+                "hub": {"providers": [{"type": "SPOTIFY", "actions": actions}]},
+            },
+        })
+
+
+class FakeSpotify(FakeUpstream):
+    """Token endpoint plus the Web API calls Stash makes (search, tracks, me, playlists, library)"""
+
+    def __init__(self, *args, catalog_size: int = 8, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.catalog = [fake_track(i) for i in range(catalog_size)]
+        self.playlists: dict[str, list[dict]] = {}  # user → playlists
+        self._playlist_ids = itertools.count(1)
+
+    @staticmethod
+    def track_item(track: dict) -> dict:
+        return {
+            "id": track["id"],
+            "name": track["title"],
+            "artists": [{"name": track["artist"]}],
+            "album": {"images": [{"url": f"https://img.example/{track['id']}.jpg"}]},
+            "uri": f"spotify:track:{track['id']}",
+            "external_urls": {"spotify": f"https://open.spotify.com/track/{track['id']}"},
+            "external_ids": {"isrc": track["isrc"]},
+            "popularity": track["popularity"],
+            "preview_url": None,
+        }
+
+    def _user(self, headers) -> str:
+        token = (headers.get("authorization") or "").removeprefix("Bearer ").strip()
+        return f"user-{token}"
+
+    def handle(self, method, path, query, headers, body):
+        if path.endswith("/api/token"):
+            return self.json_response({"access_token": "app-token", "token_type": "Bearer", "expires_in": 3600})
+
+        path = path.removeprefix("/v1")
+        user = self._user(headers)
+
+        if path == "/search":
+            q = query.get("q", "").casefold()
+            if q.startswith("isrc:"):
+                items = [t for t in self.catalog if t["isrc"].casefold() == q[5:]]
+            else:
+                items = [t for t in self.catalog if t["title"].casefold() in q or t["artist"].casefold() in q]
+            limit = int(query.get("limit", 10))
+            return self.json_response({"tracks": {"items": [self.track_item(t) for t in items[:limit]]}})
+
+        match = re.fullmatch(r"/tracks/(\w+)", path)
+        if match:
+            for track in self.catalog:
+                if track["id"] == match.group(1):
+                    return self.json_response(self.track_item(track))
+            return self.json_response({"error": {"status": 404, "message": "Not found"}}, 404)
+
+        if path in ("/me", "/me/"):
+            return self.json_response({"id": user})
+
+        with self._lock:
+            playlists = self.playlists.setdefault(user, [])
+            if path == "/me/playlists":
+                return self.json_response({"items": list(playlists), "next": None})
+
+            match = re.fullmatch(r"/users/([\w-]+)/playlists", path)
+            if match and method == "POST":
+                playlist = {"id": f"pl{next(self._playlist_ids)}", "name": json.loads(body)["name"], "owner": {"id": user}}
+                playlists.append(playlist)
+                return self.json_response(playlist, 201)
+
+            match = re.fullmatch(r"/playlists/(\w+)(/items|/tracks)?", path)
+            if match:
+                if match.group(2) and method == "POST":
+                    return self.json_response({"snapshot_id": "snap"}, 201)
+                for playlist in playlists:
+                    if playlist["id"] == match.group(1):
+                        return self.json_response({"name": playlist["name"]})
+                return self.json_response({"error": {"status": 404, "message": "Not found"}}, 404)
+
+        if path.startswith("/me/library") or path.startswith("/me/tracks"):
+            return 200, {}, b""
+
+        return self.json_response({"error": {"status": 404, "message": f"No fake for {method} {path}"}}, 404)
+
+
+class FakeRedis:
+    """
+    Just enough of the Redis protocol for the rate limiter: GET/SET/DEL, INCR(BY)/DECR(BY),
+    EXPIRE/TTL and MULTI/EXEC pipelines, with expiring keys. Speaks RESP2, or RESP3
+    after HELLO 3 (redis-py's default).
+    """
+
+    def __init__(self):
+        self.data: dict[bytes, bytes] = {}
+        self.expires: dict[bytes, float] = {}
+        self.commands = 0
+        self._server = None
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self) -> str:
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                queued = None
+                null = b"$-1\r\n"
+                while True:
+                    command = fake._read_command(self.rfile)
+                    if command is None:
+                        return
+                    name = command[0].upper()
+                    if name == b"HELLO":
+                        proto = int(command[1]) if len(command) > 1 else 2
+                        if proto == 3:
+                            null = b"_\r\n"
+                        fields = [b"$6\r\nserver\r\n", b"$5\r\nredis\r\n", b"$5\r\nproto\r\n", b":%d\r\n" % proto]
+                        reply = (b"%2\r\n" if proto == 3 else b"*4\r\n") + b"".join(fields)
+                    elif name == b"MULTI":
+                        queued, reply = [], b"+OK\r\n"
+                    elif name == b"EXEC" and queued is not None:
+                        with fake._lock:
+                            replies = [fake._execute(c, null) for c in queued]
+                        queued, reply = None, b"*%d\r\n" % len(replies) + b"".join(replies)
+                    elif name == b"DISCARD":
+                        queued, reply = None, b"+OK\r\n"
+                    elif queued is not None:
+                        queued.append(command)
+                        reply = b"+QUEUED\r\n"
+                    else:
+                        with fake._lock:
+                            reply = fake._execute(command, null)
+                    self.wfile.write(reply)
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @staticmethod
+    def _read_command(rfile) -> Optional[list[bytes]]:
+        line = rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()  # inline command
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(rfile.readline()[1:])
+            args.append(rfile.read(length + 2)[:-2])
+        return args
+
+    def _live(self, key: bytes) -> Optional[bytes]:
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def _execute(self, command: list[bytes], null: bytes) -> bytes:
+        self.commands += 1
+        name, args = command[0].upper(), command[1:]
+        if name == b"PING":
+            return b"+PONG\r\n"
+        if name in (b"SELECT", b"CLIENT"):
+            return b"+OK\r\n"
+        if name == b"GET":
+            value = self._live(args[0])
+            return null if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"SET":
+            self.data[args[0]] = args[1]
+            self.expires.pop(args[0], None)
+            return b"+OK\r\n"
+        if name == b"DEL":
+            removed = sum(self._live(key) is not None for key in args)
+            for key in args:
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return b":%d\r\n" % removed
+        if name in (b"INCR", b"DECR", b"INCRBY", b"DECRBY"):
+            amount = int(args[1]) if len(args) > 1 else 1
+            value = int(self._live(args[0]) or 0) + (amount if name.startswith(b"INCR") else -amount)
+            self.data[args[0]] = str(value).encode()
+            return b":%d\r\n" % value
+        if name == b"EXPIRE":
+            if self._live(args[0]) is None:
+                return b":0\r\n"
+            self.expires[args[0]] = time.monotonic() + int(args[1])
+            return b":1\r\n"
+        if name == b"TTL":
+            if self._live(args[0]) is None:
+                return b":-2\r\n"
+            deadline = self.expires.get(args[0])
+            return b":-1\r\n" if deadline is None else b":%d\r\n" % round(deadline - time.monotonic())
+        return b"-ERR unknown command '%s'\r\n" % command[0]
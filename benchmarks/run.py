@@ -0,0 +1,321 @@
+"""
+Offline load test for the Stash API
+Boots the FastAPI app in-process against local fakes (media, Shazam, Spotify, Gemini) and
+reports RPS and p50/p95/p99 per endpoint and per pipeline stage.
+
+Usage:
+    python -m benchmarks.run
+    python -m benchmarks.run --endpoints recognize --concurrency 1 8 32 --requests 200
+    python -m benchmarks.run --latency shazam=0.3 --errors spotify=0.05
+    python -m benchmarks.run --save-baseline main      # writes benchmarks/baselines/main.json
+    python -m benchmarks.run --compare main            # exits 1 if p95/RPS regressed
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from benchmarks.fakes import FakeGemini, FakeMedia, FakeShazam, FakeSpotify, fake_track
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+ENDPOINTS = ("recognize", "save_track", "analyze_vibe")
+FAKES = ("media", "shazam", "spotify", "gemini")
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# --- /metrics parsing (stage histograms) ---
+
+def parse_histograms(text: str) -> dict[tuple, dict[float, float]]:
+    """(stage, op) → {upper bound: cumulative count} from stash_stage_duration_seconds"""
+    series: dict[tuple, dict[float, float]] = {}
+    for line in text.splitlines():
+        if not line.startswith("stash_stage_duration_seconds_bucket{"):
+            continue
+        labels, value = line[line.index("{") + 1:].rsplit("} ", 1)
+        fields = dict(part.split("=", 1) for part in labels.split(","))
+        fields = {key: val.strip('"') for key, val in fields.items()}
+        bound = float("inf") if fields["le"] == "+Inf" else float(fields["le"])
+        series.setdefault((fields["stage"], fields["op"]), {})[bound] = float(value)
+    return series
+
+
+def histogram_quantile(buckets: dict[float, float], q: float) -> float:
+    """Prometheus-style quantile estimate, linear within the bucket"""
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]]
+    if total <= 0:
+        return 0.0
+    rank = q * total
+    previous_bound, previous_count = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if bound == float("inf"):
+                return previous_bound
+            width = count - previous_count
+            return previous_bound + (bound - previous_bound) * ((rank - previous_count) / width if width else 0)
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+def stage_report(before: str, after: str) -> dict:
+    start, end = parse_histograms(before), parse_histograms(after)
+    report = {}
+    for key, buckets in end.items():
+        delta = {bound: count - start.get(key, {}).get(bound, 0) for bound, count in buckets.items()}
+        calls = delta[float("inf")]
+        if calls <= 0:
+            continue
+        report[f"{key[0]}/{key[1]}"] = {
+            "calls": int(calls),
+            "p50_ms": round(histogram_quantile(delta, 0.50) * 1000, 1),
+            "p95_ms": round(histogram_quantile(delta, 0.95) * 1000, 1),
+            "p99_ms": round(histogram_quantile(delta, 0.99) * 1000, 1),
+        }
+    return report
+
+
+# --- Environment ---
+
+def start_fakes(args) -> dict:
+    options = {name: {"latency": args.default_latency, "error_rate": 0.0} for name in FAKES}
+    for name, value in args.latency:
+        options[name]["latency"] = value
+    for name, value in args.errors:
+        options[name]["error_rate"] = value
+
+    fakes = {
+        "media": FakeMedia(songs=args.songs, **options["media"]),
+        "shazam": FakeShazam(catalog_size=args.songs, **options["shazam"]),
+        "spotify": FakeSpotify(catalog_size=args.songs, **options["spotify"]),
+        "gemini": FakeGemini(**options["gemini"]),
+    }
+    for fake in fakes.values():
+        fake.start()
+    return fakes
+
+
+def configure_environment(fakes: dict, workdir: str, args) -> None:
+    """Point every upstream at the fakes; must run before anything imports api.*"""
+    os.environ.update({
+        "GEMINI_API_KEY": "bench",
+        "GEMINI_API_BASE": fakes["gemini"].base_url,
+        "SPOTIFY_CLIENT_ID": "bench",
+        "SPOTIFY_CLIENT_SECRET": "bench",
+        "SPOTIFY_API_BASE": f"{fakes['spotify'].base_url}/v1/",
+        "SPOTIFY_TOKEN_URL": f"{fakes['spotify'].base_url}/api/token",
+        "SHAZAM_API_BASE": fakes["shazam"].base_url,
+        "RATE_LIMIT_PER_DAY": str(10 ** 9),
+        "RATE_LIMIT_BACKEND": "memory",
+        "CACHE_DB_PATH": "",
+        "GENRE_CACHE_DB_PATH": os.path.join(workdir, "genres.db"),
+        "LOCAL_INDEX_ENABLED": "true" if args.local_index else "false",
+        "LOCAL_INDEX_PATH": os.path.join(workdir, "fpindex"),
+        "COOKIE_DIR": os.path.join(workdir, "cookies"),
+        "JOB_DB_PATH": os.path.join(workdir, "jobs.db"),
+        "JOB_WORKERS": "0",
+        "YTDLP_COOKIES": "",
+        "YTDLP_COOKIES_1": "",
+        "ENABLE_DEBUG_LOGS": "false",
+    })
+    if args.processes is not None:
+        os.environ["FINGERPRINT_PROCESSES"] = str(args.processes)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int):
+    import uvicorn
+
+    from api.index import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("API server did not start")
+        time.sleep(0.05)
+    return server, thread
+
+
+# --- Load ---
+
+def request_for(endpoint: str, i: int, run_id: str, fakes: dict, songs: int):
+    track = fake_track(i % songs)
+    if endpoint == "recognize":
+        # Unique reel URL per request so the recognition cache doesn't short-circuit the pipeline
+        return "/recognize", {"url": fakes["media"].reel_url(i % songs, f"{run_id}-{i}")}
+    if endpoint == "save_track":
+        return "/save_track", {
+            "token": f"tok{i % 20}",
+            "track_id": track["id"],
+            "playlist_id": "smart_sort" if i % 2 else "1",
+        }
+    return "/analyze_vibe", {"songs": [f"{fake_track(j)['title']} - {fake_track(j)['artist']}" for j in range(i % songs + 1)]}
+
+
+async def drive(base_url: str, endpoint: str, concurrency: int, total: int, fakes: dict, songs: int) -> dict:
+    import httpx
+
+    run_id = uuid.uuid4().hex[:8]
+    latencies, statuses = [], {}
+    counter = iter(range(total))
+
+    async def worker(client, user):
+        # One simulated client per worker, as the fair scheduler keys on the forwarded IP
+        headers = {"x-forwarded-for": f"10.0.{user // 256}.{user % 256}"}
+        for i in counter:
+            path, body = request_for(endpoint, i, run_id, fakes, songs)
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json=body, headers=headers)
+                ok = response.status_code < 400 and response.json().get("success", True) is not False
+                status = str(response.status_code) if ok or response.status_code >= 400 else "200-failed"
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client, user) for user in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "ok": statuses.get("200", 0),
+        "statuses": statuses,
+        "rps": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+# --- Reporting ---
+
+def print_results(results: dict) -> None:
+    print(f"\n{'scenario':<24}{'ok/total':>12}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<24}{result['ok']:>6}/{result['requests']:<5}{result['rps']:>10}"
+              f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}")
+        other = {k: v for k, v in result["statuses"].items() if k != "200"}
+        if other:
+            print(f"{'':<24}statuses: {other}")
+        for stage, stats in sorted(result["stages"].items()):
+            print(f"{'':<4}{stage:<36}{stats['calls']:>8} calls{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']} → {result['p95_ms']} ms")
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {base['rps']} → {result['rps']}")
+    return regressions
+
+
+def named_float(text: str) -> tuple[str, float]:
+    name, _, value = text.partition("=")
+    if name not in FAKES:
+        raise argparse.ArgumentTypeError(f"unknown upstream {name!r} (one of {', '.join(FAKES)})")
+    return name, float(value)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline Stash API load test")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--songs", type=int, default=8, help="fixture songs / catalog size")
+    parser.add_argument("--default-latency", type=float, default=0.02, help="seconds added by every fake")
+    parser.add_argument("--latency", type=named_float, action="append", default=[], metavar="UPSTREAM=SECONDS")
+    parser.add_argument("--errors", type=named_float, action="append", default=[], metavar="UPSTREAM=RATE")
+    parser.add_argument("--processes", type=int, help="FINGERPRINT_PROCESSES for the app")
+    parser.add_argument("--local-index", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed p95/RPS drift vs baseline")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own log output")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="stash_bench_")
+    fakes = start_fakes(args)
+    configure_environment(fakes, workdir, args)
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    server = None
+    results = {}
+    try:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+            server, _ = start_server(port)
+
+        import httpx
+
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                name = f"{endpoint}@c{concurrency}"
+                print(f"▶ {name} ({args.requests} requests)", flush=True)
+                before = httpx.get(f"{base_url}/metrics").text
+                with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+                    result = asyncio.run(drive(base_url, endpoint, concurrency, args.requests, fakes, args.songs))
+                result["stages"] = stage_report(before, httpx.get(f"{base_url}/metrics").text)
+                results[name] = result
+    finally:
+        if server is not None:
+            server.should_exit = True
+        for fake in fakes.values():
+            fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\n💾 Baseline saved: {path}")
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n❌ Regressions vs {args.compare} (tolerance {args.tolerance:.0%}):")
+            for regression in regressions:
+                print(f"   {regression}")
+            return 1
+        print(f"\n✅ No regressions vs {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Offline checks for canonical reel keys (recognition cache, single-flight, batch and job dedup).
+Usage: python cache_key_test.py
+"""
+import sys
+
+from api.cache import canonical_media_id
+
+def run_test(name, func):
+    try:
+        print(f"Testing {name}...", end=" ")
+        func()
+        print("✅ PASS")
+        return True
+    except Exception as e:
+        print(f"❌ FAIL: {e}")
+        return False
+
+def test_instagram_share_variants_collapse():
+    keys = {
+        canonical_media_id("https://www.instagram.com/reel/ABC123/?igsh=xyz"),
+        canonical_media_id("instagram.com/someone/reel/ABC123"),
+        canonical_media_id("https://instagram.com/p/ABC123/?utm_source=ig_web_copy_link"),
+    }
+    assert keys == {"instagram:ABC123"}, keys
+
+def test_youtube_videos_stay_distinct():
+    first = canonical_media_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+    second = canonical_media_id("https://www.youtube.com/watch?v=9bZkp7q19f0")
+    assert first != second, first
+    assert first == "youtube:dQw4w9WgXcQ", first
+
+def test_youtube_link_forms_collapse():
+    keys = {
+        canonical_media_id("https://youtube.com/watch?feature=share&v=dQw4w9WgXcQ&si=abc"),
+        canonical_media_id("https://youtu.be/dQw4w9WgXcQ?si=abc"),
+        canonical_media_id("https://m.youtube.com/shorts/dQw4w9WgXcQ"),
+    }
+    assert keys == {"youtube:dQw4w9WgXcQ"}, keys
+
+def test_generic_fallback_keeps_identity_query():
+    first = canonical_media_id("https://www.facebook.com/watch/?v=111&utm_medium=share")
+    second = canonical_media_id("https://facebook.com/watch?v=222")
+    assert first == "url:facebook.com/watch?v=111", first
+    assert first != second
+
+if __name__ == "__main__":
+    print("🧪 Starting Cache Key Tests...")
+    results = [
+        run_test("Instagram Share Variants Collapse", test_instagram_share_variants_collapse),
+        run_test("YouTube Videos Stay Distinct", test_youtube_videos_stay_distinct),
+        run_test("YouTube Link Forms Collapse", test_youtube_link_forms_collapse),
+        run_test("Generic Fallback Keeps Query", test_generic_fallback_keeps_identity_query),
+    ]
+
+    if all(results):
+        print("\n✨ Cache keys verified.")
+        sys.exit(0)
+    else:
+        print("\n⚠️ Some tests failed.")
+        sys.exit(1)
@@ -0,0 +1,95 @@
+"""
+Offline checks for the shared cookie account pool: two pools on one state file stand in for two worker processes.
+Usage: python cookie_pool_test.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from api.cookies import CookiePool, CookielessMemory
+
+workdir = tempfile.mkdtemp(prefix="stash_cookie_test_")
+
+def run_test(name, func):
+    try:
+        print(f"Testing {name}...", end=" ")
+        func()
+        print("✅ PASS")
+        return True
+    except Exception as e:
+        print(f"❌ FAIL: {e}")
+        return False
+
+def make_pools(count=2, lease=300):
+    path = os.path.join(workdir, f"state_{time.monotonic_ns()}.db")
+    cookies = [f"# cookies for account {i}" for i in range(count)]
+    return [
+        CookiePool(cookies, os.path.join(workdir, "files"), cooldown=60, max_cooldown=600, path=path, lease=lease)
+        for _ in range(2)
+    ]
+
+def test_account_is_held_across_processes():
+    first, second = make_pools(count=1)
+    account = first.acquire(timeout=0)
+    assert account is not None
+    assert second.acquire(timeout=0.3) is None, "second process got an account already in use"
+    first.release(account, "ok")
+    assert second.acquire(timeout=0) is not None
+
+def test_waiter_gets_account_released_elsewhere():
+    first, second = make_pools(count=1)
+    account = first.acquire(timeout=0)
+    started = time.monotonic()
+    threading.Timer(0.3, first.release, (account, "ok")).start()
+    assert second.acquire(timeout=5) is not None
+    assert time.monotonic() - started < 2
+
+def test_cooldown_is_shared():
+    first, second = make_pools(count=2)
+    account = first.acquire(timeout=0)
+    first.release(account, "blocked")
+    other = second.acquire(timeout=0)
+    assert other is not None and other.key != account.key, "blocked account handed out again"
+    second.release(other, "blocked")
+    # Every account cooling down and none in use: give up at once instead of waiting
+    started = time.monotonic()
+    assert second.acquire(timeout=5) is None
+    assert time.monotonic() - started < 1
+    cooling = [a for a in first.stats()["accounts"] if a["cooldown_remaining"]]
+    assert len(cooling) == 2, first.stats()
+
+def test_dead_holder_lease_expires():
+    first, second = make_pools(count=1, lease=0.5)
+    assert first.acquire(timeout=0) is not None  # never released, as if the process died
+    assert second.acquire(timeout=2) is not None
+
+def test_cookieless_memory_is_shared():
+    path = os.path.join(workdir, "cookieless.db")
+    first, second = CookielessMemory(2, 60, path), CookielessMemory(2, 60, path)
+    first.record("instagram.com", "blocked")
+    second.record("instagram.com", "blocked")
+    assert not first.should_try("instagram.com")
+    assert second.should_try("tiktok.com")
+    first.record("instagram.com", "ok")
+    assert second.should_try("instagram.com")
+
+if __name__ == "__main__":
+    print("🧪 Starting Cookie Pool Tests...")
+    results = [
+        run_test("Account Held Across Processes", test_account_is_held_across_processes),
+        run_test("Waiter Gets Account Released Elsewhere", test_waiter_gets_account_released_elsewhere),
+        run_test("Cooldown Shared", test_cooldown_is_shared),
+        run_test("Dead Holder Lease Expires", test_dead_holder_lease_expires),
+        run_test("Cookieless Memory Shared", test_cookieless_memory_is_shared),
+    ]
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if all(results):
+        print("\n✨ Cookie pool verified.")
+        sys.exit(0)
+    else:
+        print("\n⚠️ Some tests failed.")
+        sys.exit(1)
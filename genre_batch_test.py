@@ -0,0 +1,78 @@
+"""
+Offline checks for the batched Gemini genre classifier, run against a local fake Gemini.
+Usage: python genre_batch_test.py
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import FakeGemini, fake_genre
+from api.config import settings
+
+fake = FakeGemini(latency=0.05)
+settings.GEMINI_API_BASE = fake.start()
+
+from api.genres import GenreBatcher, parse_genres
+
+def run_test(name, func):
+    try:
+        print(f"Testing {name}...", end=" ")
+        func()
+        print("✅ PASS")
+        return True
+    except Exception as e:
+        print(f"❌ FAIL: {e}")
+        return False
+
+def test_concurrent_calls_share_a_prompt():
+    batcher = GenreBatcher(max_batch=20, window_ms=50, concurrency=2)
+    songs = [(f"Song {i}", f"Artist {i}") for i in range(40)]
+    before = fake.requests
+    with ThreadPoolExecutor(max_workers=40) as pool:
+        genres = list(pool.map(lambda s: batcher.classify(*s), songs))
+    assert genres == [fake_genre(*s) for s in songs], genres
+    assert fake.requests - before <= 4, f"{fake.requests - before} Gemini calls for 40 songs"
+
+def test_duplicates_in_a_batch_are_sent_once():
+    batcher = GenreBatcher(max_batch=20, window_ms=50, concurrency=1)
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        genres = list(pool.map(lambda _: batcher.classify("Same Song", "Same Artist"), range(5)))
+    assert len(set(genres)) == 1
+    assert fake.prompts[-1].count("Same Song") == 1
+
+def test_missing_answers_fall_back_to_unknown():
+    fake.drop_ids = {0}
+    try:
+        assert GenreBatcher(1, 1, 1).classify("Dropped", "Artist") == "Unknown"
+    finally:
+        fake.drop_ids = set()
+
+def test_upstream_errors_resolve_every_caller():
+    fake.error_rate = 1.0
+    try:
+        start = time.time()
+        assert GenreBatcher(5, 10, 1).classify("Any", "Artist") == "Unknown"
+        assert time.time() - start < settings.GENRE_BATCH_TIMEOUT
+    finally:
+        fake.error_rate = 0.0
+
+def test_parse_fenced_json():
+    assert parse_genres('```json\n[{"id": 0, "genre": "House."}]\n```') == {0: "House"}
+
+if __name__ == "__main__":
+    print("🧪 Starting Genre Batcher Tests...")
+    results = [
+        run_test("Concurrent Calls Share A Prompt", test_concurrent_calls_share_a_prompt),
+        run_test("Duplicate Songs Sent Once", test_duplicates_in_a_batch_are_sent_once),
+        run_test("Missing Answers → Unknown", test_missing_answers_fall_back_to_unknown),
+        run_test("Upstream Errors Resolve Callers", test_upstream_errors_resolve_every_caller),
+        run_test("Fenced JSON Parsing", test_parse_fenced_json),
+    ]
+    fake.stop()
+
+    if all(results):
+        print("\n✨ Genre batching verified.")
+        sys.exit(0)
+    else:
+        print("\n⚠️ Some tests failed.")
+        sys.exit(1)
@@ -1,8 +1,84 @@
-import uvicorn
 import os
-from api.index import app
+import threading
+
+import uvicorn
+
+from api.config import settings
+
+# Multi-worker mode keeps caches, rate limits and metrics on disk so every worker sees the same state
+# (explicit settings win; these only fill in what's unset)
+SHARED_STATE_DEFAULTS = {
+    "CACHE_DB_PATH": "/tmp/stash_cache.db",
+    "RATE_LIMIT_BACKEND": "sqlite",
+    "METRICS_DIR": "/tmp/stash_metrics",
+}
+
+
+def run_single(port: int) -> None:
+    from api.index import app
+
+    uvicorn.run(app, host="0.0.0.0", port=port, timeout_graceful_shutdown=settings.GRACEFUL_TIMEOUT)
+
+
+def run_workers(port: int) -> None:
+    """
+    WEB_WORKERS uvicorn processes behind one socket. Each worker is recycled after
+    WORKER_MAX_REQUESTS (+ jitter) requests to cap yt-dlp/ffmpeg memory growth, and
+    SIGTERM lets in-flight requests and stage work drain for GRACEFUL_TIMEOUT seconds.
+    """
+    settings.validate()
+    # Import the app once here so a broken deploy fails before any worker is started.
+    # Workers are spawned, not forked from this process: the app holds SQLite
+    # connections and thread pools that must not be shared across a fork.
+    import api.index  # noqa: F401
+    from api.audio import sweep_workdirs
+    from api.job_worker import JobWorkerPool
+    from api.jobs import job_queue
+    from api.metrics import Registry
+
+    for name, value in SHARED_STATE_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+    # Every web worker builds its own signature pool; split the cores between them
+    os.environ.setdefault("FINGERPRINT_PROCESSES", str(max(1, (os.cpu_count() or 1) // settings.WEB_WORKERS)))
+    # Counters start from zero with each deploy
+    Registry.clear(os.environ["METRICS_DIR"])
+
+    # One set of job workers for the whole box, supervised here rather than by every web worker.
+    # Async jobs are opt-in, so the workers are only started once a job shows up in the queue.
+    job_workers = JobWorkerPool(settings.JOB_WORKERS)
+    os.environ["JOB_WORKERS"] = "0"
+    stopping = threading.Event()
+
+    def supervise_job_workers():
+        while not stopping.wait(5 if job_workers.started else settings.JOB_POLL_INTERVAL):
+            if job_workers.count > 0 and not job_workers.started and job_queue.has_work():
+                job_workers.start()
+            job_workers.check()
+
+    supervisor = threading.Thread(target=supervise_job_workers, daemon=True, name="stash-job-supervisor")
+    supervisor.start()
+    try:
+        uvicorn.run(
+            "api.index:app",
+            host="0.0.0.0",
+            port=port,
+            workers=settings.WEB_WORKERS,
+            limit_max_requests=settings.WORKER_MAX_REQUESTS or None,
+            limit_max_requests_jitter=settings.WORKER_MAX_REQUESTS_JITTER,
+            timeout_graceful_shutdown=settings.GRACEFUL_TIMEOUT,
+        )
+    finally:
+        stopping.set()
+        supervisor.join()
+        job_workers.stop()
+        # Temp audio of workers that were killed mid-download
+        sweep_workdirs()
+
 
 if __name__ == "__main__":
     # Railway provides the PORT environment variable
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    if settings.WEB_WORKERS > 1:
+        run_workers(port)
+    else:
+        run_single(port)
@@ -0,0 +1,97 @@
+"""
+Offline checks for the shared rate-limit backends: SQLite, and Redis against a local fake Redis.
+Usage: python ratelimit_backend_test.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import FakeRedis
+from api.ratelimit import RedisBackend, SQLiteBackend
+
+fake = FakeRedis()
+fake.start()
+workdir = tempfile.mkdtemp(prefix="stash_ratelimit_test_")
+
+def run_test(name, func):
+    try:
+        print(f"Testing {name}...", end=" ")
+        func()
+        print("✅ PASS")
+        return True
+    except Exception as e:
+        print(f"❌ FAIL: {e}")
+        return False
+
+def sqlite_backends():
+    # Two instances on one file stand in for two worker processes
+    path = os.path.join(workdir, f"ratelimit_{time.monotonic_ns()}.db")
+    return SQLiteBackend(path), SQLiteBackend(path)
+
+def redis_backends():
+    return RedisBackend(fake.url), RedisBackend(fake.url)
+
+def check_limit_is_shared(make_backends):
+    first, second = make_backends()
+    window = 3600
+    results = [backend.hit("1.2.3.4", 5, window) for backend in (first, second) * 3]
+    assert [allowed for allowed, _ in results] == [True] * 5 + [False], results
+    assert 1 <= results[-1][1] <= window, f"retry_after {results[-1][1]}"
+    # Other clients keep their own budget
+    assert first.hit("5.6.7.8", 5, window)[0]
+
+def check_concurrent_hits_never_overshoot(make_backends):
+    first, second = make_backends()
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda i: (first, second)[i % 2].hit("burst", 20, 3600)[0], range(60)))
+    assert sum(results) == 20, f"{sum(results)} of 60 allowed with a limit of 20"
+
+def test_sqlite_limit_is_shared():
+    check_limit_is_shared(sqlite_backends)
+
+def test_sqlite_concurrent_hits():
+    check_concurrent_hits_never_overshoot(sqlite_backends)
+
+def test_sqlite_evicts_idle_keys():
+    backend, _ = sqlite_backends()
+    backend.hit("idle", 5, 1)
+    time.sleep(2.1)
+    assert backend.evict_idle(1) == 1
+    assert backend.hit("idle", 1, 1)[0]
+
+def test_redis_limit_is_shared():
+    check_limit_is_shared(redis_backends)
+
+def test_redis_concurrent_hits():
+    check_concurrent_hits_never_overshoot(redis_backends)
+
+def test_redis_rejections_are_not_counted():
+    backend, _ = redis_backends()
+    for _ in range(10):
+        backend.hit("rejected", 2, 3600)
+    counters = [key for key in fake.data if key.startswith(b"stash:rl:rejected:")]
+    assert len(counters) == 1 and fake.data[counters[0]] == b"2", fake.data
+    assert 0 < fake.expires[counters[0]] - time.monotonic() <= 2 * 3600
+
+if __name__ == "__main__":
+    print("🧪 Starting Rate Limit Backend Tests...")
+    results = [
+        run_test("SQLite Limit Shared Across Workers", test_sqlite_limit_is_shared),
+        run_test("SQLite Concurrent Hits Never Overshoot", test_sqlite_concurrent_hits),
+        run_test("SQLite Evicts Idle Keys", test_sqlite_evicts_idle_keys),
+        run_test("Redis Limit Shared Across Workers", test_redis_limit_is_shared),
+        run_test("Redis Concurrent Hits Never Overshoot", test_redis_concurrent_hits),
+        run_test("Redis Rejections Not Counted", test_redis_rejections_are_not_counted),
+    ]
+    fake.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if all(results):
+        print("\n✨ Rate limit backends verified.")
+        sys.exit(0)
+    else:
+        print("\n⚠️ Some tests failed.")
+        sys.exit(1)
@@ -20,6 +20,7 @@ export interface SongMatch {
   preview_url?: string;
   spotify_url?: string;
   confidence?: number;
+  match_source?: 'metadata' | 'fingerprint' | 'local_index';
 }
 
 export interface Playlist {
@@ -107,7 +108,8 @@ export const api = {
           album_art_url: data.album_art,
           preview_url: data.preview_url,
           spotify_url: data.spotify_url,
-          confidence: data.confidence
+          confidence: data.confidence,
+          match_source: data.source
         }];
       } else {
         throw new Error(data.error || "Failed to recognize song");
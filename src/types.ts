@@ -18,6 +18,7 @@ export interface SongMatch {
     preview_url?: string;
     spotify_url?: string;
     confidence?: number;
+    match_source?: 'metadata' | 'fingerprint' | 'local_index';
 }
 
 export interface AppState {